@@ -0,0 +1,394 @@
+#!/usr/bin/env python3
+"""Offline benchmark for the full split pipeline.
+
+Generates synthetic tracks with a known tempo and key, runs them through
+stem_splitter.split_song() and reports per-stage throughput and real-time
+factor. By default a deterministic stub stands in for the Demucs models, so
+decode, analysis, orchestration and I/O overhead can be measured on any
+CPU-only machine without model weights or network access. Use --real to
+benchmark the actual models instead.
+
+Examples:
+    python benchmark.py
+    python benchmark.py --durations 30 300 --sample-rates 44100 48000
+    python benchmark.py --save-baseline bench_baseline.json
+    python benchmark.py --baseline bench_baseline.json --tolerance 0.25
+    python benchmark.py --profiles --durations 30 --sample-rates 44100
+"""
+import argparse
+import json
+import os
+import platform
+import shutil
+import sys
+import tempfile
+import time
+from types import SimpleNamespace
+
+import numpy as np
+import soundfile as sf
+import torch
+
+import stem_splitter
+from demucs_engine import DemucsEngine, configure_threads, get_engine, register_engine
+from profiler import RunProfiler, write_report
+
+# Tempo and key of each synthetic track, cycled through for every case
+TRACK_STYLES = [(120, "Am"), (95, "C"), (128, "F#m"), (140, "D")]
+
+DRUMSEP_SOURCES = ["bombo", "redoblante", "platillos", "toms"]
+
+# Length of the untimed track split before the first case
+WARMUP_SECONDS = 10
+
+
+class StubEngine(DemucsEngine):
+    """Deterministic stand-in for a Demucs model.
+
+    Splits the spectrum into one band per source, which costs a couple of
+    FFTs instead of a neural network but produces stems of the same shape.
+    """
+
+    def __init__(self, model_name, sources, repo=None, samplerate=44100, audio_channels=2):
+        super().__init__(model_name, repo=repo)
+        self.stub_model = SimpleNamespace(sources=list(sources), samplerate=samplerate,
+                                          audio_channels=audio_channels)
+        self.model = self.stub_model
+
+    def load(self):
+        # configure() drops the model when quantization changes; there's nothing to reload
+        self.model = self.stub_model
+        return self.model
+
+    @property
+    def settings(self):
+        return dict(super().settings, stub=True)
+
+    def separate_tensor(self, wav):
+        length = wav.shape[-1]
+        spectrum = torch.fft.rfft(wav, dim=-1)
+        freqs = torch.fft.rfftfreq(length, 1 / self.samplerate)
+        # Log-spaced bands from 40 Hz up to Nyquist, one per source
+        edges = np.geomspace(40, self.samplerate / 2, len(self.sources) + 1)
+        edges[0], edges[-1] = 0, np.inf
+        stems = {}
+        for i, name in enumerate(self.sources):
+            mask = ((freqs >= edges[i]) & (freqs < edges[i + 1])).to(spectrum.dtype)
+            stems[name] = torch.fft.irfft(spectrum * mask, n=length, dim=-1)
+        return stems
+
+
+def note_frequency(midi_note):
+    return 440.0 * 2 ** ((midi_note - 69) / 12)
+
+
+def synth_track(duration, samplerate, bpm, key, seed=0):
+    """A stereo loop with a kick on every beat, offbeat hats and a sustained chord in key."""
+    rng = np.random.default_rng(seed)
+    n = int(duration * samplerate)
+    t = np.arange(n) / samplerate
+
+    # Chord: root, third and fifth with a couple of harmonics, plus a bass note
+    minor = key.endswith("m")
+    root = 48 + stem_splitter.KEY_NAMES.index(key.rstrip("m"))
+    chord = [root, root + (3 if minor else 4), root + 7, root + 12]
+    harmony = np.zeros(n)
+    for note in chord:
+        f = note_frequency(note)
+        for harmonic, gain in ((1, 1.0), (2, 0.4), (3, 0.2)):
+            harmony += gain * np.sin(2 * np.pi * f * harmonic * t)
+    harmony += 1.5 * np.sin(2 * np.pi * note_frequency(root - 12) * t)
+    harmony *= 0.04
+
+    # Drums: decaying 60 Hz kick on each beat, short noise burst on each offbeat
+    drums = np.zeros(n)
+    beat = 60.0 / bpm
+    kick_len = int(0.15 * samplerate)
+    kick_t = np.arange(kick_len) / samplerate
+    kick = np.sin(2 * np.pi * 60 * kick_t) * np.exp(-kick_t * 30)
+    hat_len = int(0.03 * samplerate)
+    hat = rng.standard_normal(hat_len) * np.exp(-np.arange(hat_len) / (0.005 * samplerate)) * 0.3
+    for i in range(int(duration / beat) + 1):
+        start = int(i * beat * samplerate)
+        end = min(start + kick_len, n)
+        drums[start:end] += kick[:end - start]
+        offbeat = int((i + 0.5) * beat * samplerate)
+        end = min(offbeat + hat_len, n)
+        if offbeat < n:
+            drums[offbeat:end] += hat[:end - offbeat]
+
+    mix = harmony + 0.6 * drums
+    mix /= max(np.abs(mix).max(), 1e-9) * 1.25
+    return np.stack([mix, np.roll(mix, 7)], axis=1).astype(np.float32)
+
+
+def install_stubs(config):
+    """Register stub engines for the configured demucs model and the drum model."""
+    model = config["tools"]["demucs_model"]
+    sources = stem_splitter.MODEL_STEMS.get(model, ["bass", "drums", "other", "vocals"])
+    register_engine(StubEngine(model, sources))
+
+    drumsep = stem_splitter.load_drumsep_module(config["tools"]["drumsep_dir"])
+    drum_repo = drumsep.get_drum_engine().repo
+    register_engine(StubEngine(stem_splitter.DRUMSEP_MODEL_ID, DRUMSEP_SOURCES, repo=drum_repo))
+
+
+def make_tracks(tracks_dir, durations, sample_rates):
+    """Write one synthetic track per duration and sample rate; returns [(case, file, bpm, key)]."""
+    tracks = []
+    for duration in durations:
+        for samplerate in sample_rates:
+            bpm, key = TRACK_STYLES[len(tracks) % len(TRACK_STYLES)]
+            track_file = os.path.join(tracks_dir, f"bench_{duration:g}s_{samplerate}.wav")
+            sf.write(track_file, synth_track(duration, samplerate, bpm, key, seed=len(tracks)), samplerate)
+            tracks.append((f"{duration:g}s@{samplerate}", track_file, bpm, key))
+    return tracks
+
+
+def sdr(reference, estimate):
+    """Signal-to-distortion ratio of estimate against reference, in dB."""
+    length = min(reference.shape[-1], estimate.shape[-1])
+    reference, estimate = reference[..., :length], estimate[..., :length]
+    noise = ((reference - estimate) ** 2).sum().item()
+    if noise == 0:
+        return float("inf")
+    return 10 * np.log10(max((reference ** 2).sum().item(), 1e-20) / noise)
+
+
+def compare_profiles(track_files, config, names):
+    """Time the real models under each performance profile and measure drift from "quality".
+
+    Every profile separates the same tracks (demucs, then drumsep on the
+    drums stem). Returns {profile: {seconds, real_time_factor, speedup,
+    sdr: {output: mean dB against the quality output}}}.
+    """
+    names = ["quality"] + [name for name in names if name != "quality"]
+    engine = get_engine(config["tools"]["demucs_model"])
+    drumsep = stem_splitter.load_drumsep_module(config["tools"]["drumsep_dir"])
+    drum_engine = drumsep.get_drum_engine()
+    default_threads = torch.get_num_threads()
+    reference = {}
+    results = {}
+    for name in names:
+        config["performance"]["profile"] = name
+        profile = stem_splitter.performance_profile(config)
+        print(f"\n⏱️ Profile {name}: {profile}")
+        configure_threads(profile["intra_op_threads"] or default_threads)
+        stem_splitter.configure_engine(engine, config).load()
+        stem_splitter.configure_engine(drum_engine, config).load()
+        # Warm up so one-off allocations don't count against the first profile
+        engine.separate_tensor(torch.zeros(engine.audio_channels, engine.samplerate))
+
+        seconds = audio_seconds = 0
+        drift = {}
+        for track_file in track_files:
+            wav = engine.read_audio(track_file)
+            start = time.perf_counter()
+            stems = engine.separate_tensor(wav)
+            parts = drumsep.separate_drums_tensor(stems["drums"], engine.samplerate)
+            seconds += time.perf_counter() - start
+            audio_seconds += wav.shape[-1] / engine.samplerate
+
+            outputs = dict(stems, **{f"drums/{part}": audio for part, audio in parts.items()})
+            if name == "quality":
+                reference[track_file] = outputs
+            for output, audio in outputs.items():
+                drift.setdefault(output, []).append(sdr(reference[track_file][output], audio))
+        results[name] = {
+            "profile": profile,
+            "seconds": seconds,
+            "real_time_factor": seconds / audio_seconds,
+            "sdr": {output: float(np.mean(values)) for output, values in drift.items()},
+        }
+    for result in results.values():
+        result["speedup"] = results["quality"]["seconds"] / result["seconds"]
+    return results
+
+
+def print_profile_comparison(results):
+    print("\n📊 Performance profiles against quality")
+    for name, result in results.items():
+        if name == "quality":
+            drift = "reference"
+        else:
+            values = result["sdr"].values()
+            drift = f"SDR mean {np.mean(list(values)):5.1f} dB, worst {min(values):5.1f} dB"
+        print(f"  {name:<10} RTF {result['real_time_factor']:7.3f}  {result['speedup']:5.2f}x  {drift}")
+        if name != "quality":
+            print("    " + ", ".join(f"{output} {value:.1f}" for output, value in sorted(result["sdr"].items())))
+
+
+def warm_up(tracks_dir, config):
+    """Split one short track untimed, so librosa's JIT compilation doesn't skew the first case."""
+    bpm, key = TRACK_STYLES[0]
+    track_file = os.path.join(tracks_dir, "warmup.wav")
+    sf.write(track_file, synth_track(WARMUP_SECONDS, 44100, bpm, key), 44100)
+    stem_splitter.split_song(track_file, config, open_result=False)
+
+
+def run_case(track_file, config, expected_bpm, expected_key):
+    """Run one track through the pipeline and return its profile report."""
+    profiler = RunProfiler(os.path.basename(track_file))
+    stem_splitter.split_song(track_file, config, open_result=False, profiler=profiler)
+    report = profiler.report()
+    info = report["info"]
+    report["expected"] = {"bpm": expected_bpm, "key": expected_key}
+    report["bpm_ok"] = any(abs(info.get("bpm", 0) * f - expected_bpm) <= 2 for f in (0.5, 1, 2))
+    report["key_ok"] = info.get("key") == expected_key
+    return report
+
+
+def summarize_case(report):
+    """Reduce a report to the numbers that are compared against a baseline."""
+    stages = {}
+    for stage in report["stages"]:
+        rtf = stage["real_time_factor"] or 0
+        stages[stage["stage"]] = stages.get(stage["stage"], 0) + rtf
+    return {"real_time_factor": report["real_time_factor"], "stages": stages}
+
+
+def compare_to_baseline(results, baseline, tolerance):
+    """Return a list of (case, stage, baseline RTF, current RTF) regressions."""
+    regressions = []
+    for case, current in results["cases"].items():
+        previous = baseline.get("cases", {}).get(case)
+        if not previous:
+            continue
+        pairs = [("total", previous["real_time_factor"], current["real_time_factor"])]
+        pairs += [(stage, previous["stages"][stage], rtf)
+                  for stage, rtf in current["stages"].items() if stage in previous["stages"]]
+        for stage, before, now in pairs:
+            # Ignore stages too quick to time reliably
+            if before and now and now > before * (1 + tolerance) and now - before > 0.001:
+                regressions.append((case, stage, before, now))
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the stem splitting pipeline on synthetic audio")
+    parser.add_argument("--durations", type=float, nargs="+", default=[30, 120],
+                        help="Track lengths in seconds (default: 30 120)")
+    parser.add_argument("--sample-rates", type=int, nargs="+", default=[44100, 48000],
+                        help="Sample rates of the generated tracks (default: 44100 48000)")
+    parser.add_argument("--real", action="store_true",
+                        help="Use the real demucs and drumsep models instead of the stub separator")
+    parser.add_argument("-c", "--config", help="Path to config file")
+    parser.add_argument("-m", "--model", help="Override demucs model")
+    parser.add_argument("--analysis", choices=sorted(stem_splitter.ANALYSIS_SAMPLE_RATES),
+                        help="Key/BPM analysis mode to benchmark")
+    parser.add_argument("--output", help="Write full results as JSON to this file")
+    parser.add_argument("--baseline", help="Compare against results saved with --save-baseline")
+    parser.add_argument("--save-baseline", help="Save these results as a baseline")
+    parser.add_argument("--tolerance", type=float, default=0.2,
+                        help="Allowed real-time factor increase over the baseline (default: 0.2 = 20%%)")
+    parser.add_argument("--keep", action="store_true", help="Keep the generated tracks and outputs")
+    parser.add_argument("--profiles", nargs="*", metavar="PROFILE",
+                        help="Compare performance profiles (default: all) on the real models: speedup and "
+                             "SDR against the quality profile")
+    parser.add_argument("--audio", nargs="+", metavar="FILE",
+                        help="With --profiles, use these files instead of synthetic tracks")
+    args = parser.parse_args()
+
+    work_dir = tempfile.mkdtemp(prefix="stem_bench_")
+    config = stem_splitter.load_config(args.config)
+    config["paths"]["temp_dir"] = os.path.join(work_dir, "temp")
+    config["paths"]["output_dir"] = os.path.join(work_dir, "output")
+    config["cache"]["enabled"] = False
+    config["library"]["enabled"] = False
+    if args.model:
+        config["tools"]["demucs_model"] = args.model
+    if args.analysis:
+        config["analysis"]["mode"] = args.analysis
+
+    if args.profiles is not None:
+        names = args.profiles or list(config["performance"]["profiles"])
+        unknown = [name for name in names + ["quality"] if name not in config["performance"]["profiles"]]
+        if unknown:
+            parser.error(f"unknown performance profile(s): {', '.join(unknown)}")
+        try:
+            tracks_dir = os.path.join(work_dir, "tracks")
+            os.makedirs(tracks_dir)
+            track_files = args.audio or [track_file for _, track_file, _, _ in
+                                         make_tracks(tracks_dir, args.durations, args.sample_rates)]
+            results = compare_profiles(track_files, config, names)
+        finally:
+            if args.keep:
+                print(f"Kept benchmark files in {work_dir}")
+            else:
+                shutil.rmtree(work_dir, ignore_errors=True)
+        print_profile_comparison(results)
+        if args.output:
+            write_report({"model": config["tools"]["demucs_model"], "profiles": results}, args.output)
+            print(f"\nWrote results to {args.output}")
+        return 0
+
+    if not args.real:
+        install_stubs(config)
+
+    results = {
+        "separator": "real" if args.real else "stub",
+        "model": config["tools"]["demucs_model"],
+        "analysis_mode": config["analysis"]["mode"],
+        "machine": {
+            "platform": platform.platform(),
+            "python": platform.python_version(),
+            "cpu_count": os.cpu_count(),
+            "torch_threads": torch.get_num_threads(),
+        },
+        "cases": {},
+        "reports": [],
+    }
+
+    try:
+        tracks_dir = os.path.join(work_dir, "tracks")
+        os.makedirs(tracks_dir)
+        tracks = make_tracks(tracks_dir, args.durations, args.sample_rates)
+        print("\n🔥 Warming up (untimed)")
+        warm_up(tracks_dir, config)
+        for case, track_file, bpm, key in tracks:
+            print(f"\n⏱️ Benchmarking {case} ({bpm} BPM, {key})")
+            report = run_case(track_file, config, bpm, key)
+            results["reports"].append(report)
+            results["cases"][case] = summarize_case(report)
+    finally:
+        if args.keep:
+            print(f"Kept benchmark files in {work_dir}")
+        else:
+            shutil.rmtree(work_dir, ignore_errors=True)
+
+    # Per-stage table: throughput is seconds of audio processed per wall second
+    print(f"\n📊 Results ({results['separator']} separator, model {results['model']}, "
+          f"{results['analysis_mode']} analysis)")
+    for report in results["reports"]:
+        print(f"\n{report['name']}: {report['audio_seconds']:.0f}s audio, "
+              f"{report['wall_seconds']:.2f}s wall, RTF {report['real_time_factor']:.3f}, "
+              f"key {'✅' if report['key_ok'] else '❌'} {report['info'].get('key')}, "
+              f"bpm {'✅' if report['bpm_ok'] else '❌'} {report['info'].get('bpm')}")
+        for stage in report["stages"]:
+            rtf = stage["real_time_factor"] or 0
+            throughput = f"{1 / rtf:8.1f}x realtime" if rtf else "        -"
+            print(f"  {stage['stage']:<14} {stage['wall_seconds']:8.3f}s  RTF {rtf:7.4f}  {throughput}")
+
+    if args.output:
+        write_report(results, args.output)
+        print(f"\nWrote results to {args.output}")
+    if args.save_baseline:
+        write_report({key: results[key] for key in ("separator", "model", "analysis_mode", "machine", "cases")},
+                     args.save_baseline)
+        print(f"Saved baseline to {args.save_baseline}")
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        regressions = compare_to_baseline(results, baseline, args.tolerance)
+        if regressions:
+            print(f"\n❌ {len(regressions)} regression(s) against {args.baseline}:")
+            for case, stage, before, now in regressions:
+                print(f"  {case} {stage}: RTF {before:.4f} -> {now:.4f} ({now / before - 1:+.0%})")
+            return 1
+        print(f"\n✅ No regressions against {args.baseline} (tolerance {args.tolerance:.0%})")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,100 @@
+#!/usr/bin/env python3
+"""Per-song stage manifests so an interrupted run can pick up where it stopped.
+
+Each song being processed gets a folder under ``temp_dir/runs`` holding a
+``manifest.json`` and the files each finished stage produced. A stage only
+counts as done if every file it recorded still has the same checksum, so a
+truncated or deleted artifact simply makes that stage run again.
+"""
+import json
+import os
+import shutil
+import threading
+import time
+
+from separation_cache import cache_key, file_checksum
+
+MANIFEST_FILE = "manifest.json"
+
+
+def run_key(input_file, settings):
+    """Identify a run by the input file's path, size and mtime plus the separation settings."""
+    stat = os.stat(input_file)
+    fingerprint = f"{os.path.abspath(input_file)}:{stat.st_size}:{stat.st_mtime_ns}"
+    return cache_key(fingerprint, settings)
+
+
+class RunManifest:
+    """Completed stages of one song, with their artifacts and checksums."""
+
+    def __init__(self, run_dir, input_file=None):
+        self.run_dir = run_dir
+        self.path = os.path.join(run_dir, MANIFEST_FILE)
+        # Background analysis records its stage while the main thread saves others
+        self._lock = threading.RLock()
+        try:
+            with open(self.path, 'r') as f:
+                self.data = json.load(f)
+        except (OSError, ValueError):
+            self.data = {"input": input_file, "created": time.time(), "stages": {}}
+
+    def stage_dir(self, stage):
+        """Folder for a stage's artifacts, emptied if an earlier attempt left files behind."""
+        folder = os.path.join(self.run_dir, stage)
+        if stage not in self.data["stages"]:
+            shutil.rmtree(folder, ignore_errors=True)
+        os.makedirs(folder, exist_ok=True)
+        return folder
+
+    def completed(self, stage):
+        """Return the stage's record if it finished and its artifacts are intact, else None."""
+        record = self.data["stages"].get(stage)
+        if record is None:
+            return None
+        for name, path in record["artifacts"].items():
+            try:
+                intact = file_checksum(path) == record["checksums"][name]
+            except (OSError, KeyError):
+                intact = False
+            if not intact:
+                print(f"⚠️ Checkpointed {stage} output {name} is missing or changed, redoing {stage}")
+                with self._lock:
+                    self.data["stages"].pop(stage, None)
+                return None
+        return record
+
+    def complete(self, stage, artifacts=None, **data):
+        """Record a finished stage with its {name: path} artifacts and any extra data."""
+        artifacts = dict(artifacts or {})
+        record = dict(
+            data,
+            artifacts=artifacts,
+            checksums={name: file_checksum(path) for name, path in artifacts.items()},
+            finished=time.time(),
+        )
+        with self._lock:
+            self.data["stages"][stage] = record
+            self._write()
+
+    def save(self, stage, sources, write_fn, extension=".wav", **data):
+        """Write {name: tensor} with write_fn(tensor, path), record the stage and return {name: path}."""
+        folder = self.stage_dir(stage)
+        artifacts = {}
+        for name, source in sources.items():
+            filename = os.path.splitext(name)[0] + extension
+            artifacts[name] = os.path.join(folder, filename)
+            write_fn(source, artifacts[name])
+        self.complete(stage, artifacts, **data)
+        return artifacts
+
+    def clear(self):
+        """Delete the manifest and all artifacts once the song is finished."""
+        shutil.rmtree(self.run_dir, ignore_errors=True)
+
+    def _write(self):
+        os.makedirs(self.run_dir, exist_ok=True)
+        tmp = f"{self.path}.tmp-{os.getpid()}"
+        with open(tmp, 'w') as f:
+            json.dump(self.data, f, indent=2)
+        # Swap in atomically so a crash never leaves a half-written manifest
+        os.replace(tmp, self.path)
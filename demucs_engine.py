@@ -0,0 +1,386 @@
+#!/usr/bin/env python3
+"""In-process Demucs separation with a warm, reusable model.
+
+Shelling out to the ``demucs`` CLI pays interpreter start-up, the torch
+import and the checkpoint load for every song. A ``DemucsEngine`` loads the
+model once and keeps it around, so every song after the first only pays for
+the actual inference.
+
+torch and demucs are only imported once something is loaded, decoded or
+separated, so importing this module (e.g. for ``--help``) stays cheap.
+"""
+import os
+from pathlib import Path
+
+
+# Output encodings: name -> (file extension, soundfile format, subtype)
+OUTPUT_FORMATS = {
+    "wav16": (".wav", "WAV", "PCM_16"),
+    "wav24": (".wav", "WAV", "PCM_24"),
+    "float32": (".wav", "WAV", "FLOAT"),
+    "flac": (".flac", "FLAC", "PCM_16"),
+    "flac24": (".flac", "FLAC", "PCM_24"),
+}
+
+
+# Inference options a performance profile can set on an engine
+ENGINE_OPTIONS = ("shifts", "overlap", "segment", "inference_mode", "quantize")
+
+
+class SeparationError(Exception):
+    """Raised when a Demucs model cannot be loaded or applied."""
+
+
+def output_extension(output_format):
+    return OUTPUT_FORMATS[output_format][0]
+
+
+def open_audio_writer(path, samplerate, channels, output_format="wav16", compression_level=None):
+    """Open a soundfile writer for one of OUTPUT_FORMATS.
+
+    compression_level (0-8, like the flac command line tool) only applies to FLAC.
+    """
+    import soundfile as sf
+
+    _, file_format, subtype = OUTPUT_FORMATS[output_format]
+    options = {}
+    if file_format == "FLAC" and compression_level is not None:
+        options["compression_level"] = compression_level / 8
+    return sf.SoundFile(str(path), 'w', samplerate=samplerate, channels=channels,
+                        format=file_format, subtype=subtype, **options)
+
+
+def matches_output_format(path, samplerate, channels, output_format):
+    """Whether a file already has the container, sample format, rate and channels of output_format."""
+    import soundfile as sf
+
+    _, file_format, subtype = OUTPUT_FORMATS[output_format]
+    try:
+        info = sf.info(str(path))
+    except RuntimeError:
+        return False
+    return (info.format, info.subtype, info.samplerate, info.channels) == (file_format, subtype, samplerate, channels)
+
+
+class DemucsEngine:
+    """A Demucs model that is loaded once and reused for every track."""
+
+    def __init__(self, model_name, repo=None, device="cpu"):
+        self.model_name = model_name
+        self.repo = Path(repo) if repo else None
+        self.device = device
+        self.model = None
+        # Inference parameters, same defaults as the demucs CLI
+        self.shifts = 1
+        self.overlap = 0.25
+        self.split = True
+        # Seconds per chunk fed to the model, None for the model's own default
+        self.segment = None
+        # torch.inference_mode() skips autograd bookkeeping that no_grad() still does
+        self.inference_mode = True
+        # Dynamic int8 quantization of the Linear and LSTM layers (CPU only)
+        self.quantize = False
+
+    def configure(self, **options):
+        """Set inference options from ENGINE_OPTIONS, reloading the model if it must change."""
+        for name, value in options.items():
+            if name not in ENGINE_OPTIONS:
+                raise ValueError(f"Unknown engine option: {name}")
+            if name == "quantize" and bool(value) != self.quantize:
+                self.model = None
+            setattr(self, name, bool(value) if name in ("inference_mode", "quantize") else value)
+        return self
+
+    def load(self):
+        """Load the model if it isn't loaded yet and return it."""
+        if self.model is None:
+            from demucs.pretrained import get_model
+            try:
+                model = get_model(self.model_name, repo=self.repo)
+            except Exception as e:
+                raise SeparationError(f"Could not load demucs model '{self.model_name}': {e}") from e
+            model.to(self.device)
+            model.eval()
+            if self.quantize and str(self.device) == "cpu":
+                import torch
+                model = torch.ao.quantization.quantize_dynamic(
+                    model, {torch.nn.Linear, torch.nn.LSTM}, dtype=torch.qint8
+                )
+            self.model = model
+        return self.model
+
+    @property
+    def settings(self):
+        """Everything besides the input audio that affects the separation."""
+        return {
+            "model": self.model_name,
+            "shifts": self.shifts,
+            "overlap": self.overlap,
+            "split": self.split,
+            "segment": self.segment,
+            "quantize": self.quantize,
+        }
+
+    @property
+    def sources(self):
+        return list(self.load().sources)
+
+    @property
+    def samplerate(self):
+        return self.load().samplerate
+
+    @property
+    def audio_channels(self):
+        return self.load().audio_channels
+
+    def read_audio(self, audio_file):
+        """Decode a file to a (channels, samples) tensor at the model's rate."""
+        from demucs.audio import AudioFile, convert_audio
+
+        audio_file = Path(audio_file)
+        if not audio_file.exists():
+            raise SeparationError(f"Audio file not found: {audio_file}")
+        try:
+            return AudioFile(audio_file).read(
+                streams=0, samplerate=self.samplerate, channels=self.audio_channels
+            )
+        except FileNotFoundError:
+            # ffmpeg isn't installed, let torchaudio try instead
+            try:
+                import torchaudio
+                wav, sr = torchaudio.load(str(audio_file))
+            except Exception as e:
+                raise SeparationError(f"Could not decode {audio_file}: {e}") from e
+            return convert_audio(wav, sr, self.samplerate, self.audio_channels)
+        except Exception as e:
+            raise SeparationError(f"Could not decode {audio_file}: {e}") from e
+
+    def duration(self, audio_file):
+        """Length of a file in seconds without decoding it, or None if unknown."""
+        from demucs.audio import AudioFile
+
+        try:
+            return AudioFile(Path(audio_file)).duration()
+        except Exception:
+            return None
+
+    def read_segment(self, audio_file, start, length):
+        """Decode length samples starting at sample start, at the model's rate."""
+        from demucs.audio import AudioFile
+
+        samplerate = self.samplerate
+        try:
+            wav = AudioFile(Path(audio_file)).read(
+                seek_time=start / samplerate, duration=length / samplerate,
+                streams=0, samplerate=samplerate, channels=self.audio_channels
+            )
+        except Exception as e:
+            raise SeparationError(f"Could not decode {audio_file}: {e}") from e
+        return wav[..., :length]
+
+    def resample(self, wav, samplerate):
+        """Convert a tensor at samplerate to the model's rate and channel count."""
+        from demucs.audio import convert_audio
+
+        return convert_audio(wav, samplerate, self.samplerate, self.audio_channels)
+
+    def separate_tensor(self, wav):
+        """Separate a (channels, samples) tensor into a {source: tensor} dict."""
+        import torch
+        from demucs.apply import apply_model
+
+        model = self.load()
+        # Same normalization the demucs CLI applies before inference
+        ref = wav.mean(0)
+        mean, std = ref.mean(), ref.std()
+        if not std > 0:
+            std = torch.tensor(1.0)
+        wav = (wav - mean) / std
+        segment = self.segment
+        if segment:
+            # Transformer models can't take chunks longer than they were trained on
+            limit = getattr(model, "max_allowed_segment", None) or getattr(model, "segment", None)
+            segment = min(segment, limit or segment)
+        try:
+            with torch.inference_mode() if self.inference_mode else torch.no_grad():
+                sources = apply_model(
+                    model, wav[None], device=self.device, shifts=self.shifts,
+                    split=self.split, overlap=self.overlap, progress=False, segment=segment
+                )[0]
+        except Exception as e:
+            raise SeparationError(f"Demucs model '{self.model_name}' failed: {e}") from e
+        sources = sources * std + mean
+        return dict(zip(model.sources, sources))
+
+    def separate_segments(self, audio_file, segment_seconds=60, overlap_seconds=2):
+        """Yield (mix, {source: tensor}) blocks that cover the file in order.
+
+        Only one segment is decoded and separated at a time, so memory use
+        depends on segment_seconds rather than the length of the file.
+        Neighbouring segments overlap and are crossfaded.
+        """
+        import torch
+
+        segment = int(segment_seconds * self.samplerate)
+        overlap = min(int(overlap_seconds * self.samplerate), segment // 2)
+        step = segment - overlap
+        fade_in = torch.linspace(0, 1, overlap)
+
+        start = 0
+        tail_mix, tail = None, None
+        while True:
+            mix = self.read_segment(audio_file, start, segment)
+            length = mix.shape[-1]
+            if length == 0:
+                # The file ended exactly where the previous segment did
+                if tail is not None:
+                    yield tail_mix, tail
+                return
+
+            stems = self.separate_tensor(mix)
+            if tail is not None:
+                n = min(overlap, length)
+                for name, stem in stems.items():
+                    stem[..., :n] = tail[name][..., :n] * (1 - fade_in[:n]) + stem[..., :n] * fade_in[:n]
+
+            if length < segment:
+                yield mix, stems
+                return
+
+            # Hold back the overlap so it can be crossfaded with the next segment
+            tail_mix = mix[..., step:]
+            tail = {name: stem[..., step:] for name, stem in stems.items()}
+            yield mix[..., :step], {name: stem[..., :step] for name, stem in stems.items()}
+            start += step
+
+    def separate_file_streaming(self, audio_file, output_dir, segment_seconds=60,
+                                overlap_seconds=2, on_block=None, output_format="wav16",
+                                compression_level=None):
+        """Separate a file segment by segment, appending to one file per source.
+
+        on_block(mix, stems) is called for every block, e.g. to analyze it.
+        Samples are clamped because rescaling needs the whole file up front.
+        """
+        os.makedirs(output_dir, exist_ok=True)
+        paths = {}
+        writers = {}
+        try:
+            for mix, stems in self.separate_segments(audio_file, segment_seconds, overlap_seconds):
+                for name, stem in stems.items():
+                    if name not in writers:
+                        paths[name] = os.path.join(output_dir, name + output_extension(output_format))
+                        writers[name] = open_audio_writer(
+                            paths[name], self.samplerate, stem.shape[0], output_format, compression_level
+                        )
+                    writers[name].write(stem.clamp(-1, 1).t().cpu().numpy())
+                if on_block:
+                    on_block(mix, stems)
+        finally:
+            for writer in writers.values():
+                writer.close()
+        return paths
+
+    def save_audio(self, wav, path, clip="rescale", output_format="wav16", compression_level=None):
+        """Write one separated tensor to a file, like the demucs CLI does."""
+        from demucs.audio import save_audio
+
+        if output_format == "wav16" and compression_level is None:
+            save_audio(wav.cpu(), str(path), samplerate=self.samplerate, clip=clip, bits_per_sample=16)
+            return
+        wav = wav.cpu()
+        if clip == "rescale":
+            # Same as the demucs CLI: scale down just enough to avoid clipping
+            wav = wav / max(1.01 * wav.abs().max().item(), 1)
+        elif clip == "clamp":
+            wav = wav.clamp(-1, 1)
+        with open_audio_writer(path, self.samplerate, wav.shape[0], output_format, compression_level) as out:
+            out.write(wav.t().numpy())
+
+    def transcode_file(self, audio_file, path, segment_seconds=60, output_format="wav16",
+                       compression_level=None):
+        """Convert any input to the model's rate and the given format, one segment at a time."""
+        segment = int(segment_seconds * self.samplerate)
+        start = 0
+        with open_audio_writer(path, self.samplerate, self.audio_channels,
+                               output_format, compression_level) as out:
+            while True:
+                wav = self.read_segment(audio_file, start, segment)
+                if wav.shape[-1] == 0:
+                    break
+                out.write(wav.clamp(-1, 1).t().cpu().numpy())
+                start += segment
+
+    def save_stems(self, stems, output_dir):
+        """Write a {source: tensor} dict as ``{output_dir}/{source}.wav``."""
+        os.makedirs(output_dir, exist_ok=True)
+        paths = {}
+        for name, source in stems.items():
+            path = os.path.join(output_dir, f"{name}.wav")
+            self.save_audio(source, path)
+            paths[name] = path
+        return paths
+
+    def separate_file(self, audio_file, output_dir):
+        """Separate a file on disk, writing one WAV per source into output_dir."""
+        stems = self.separate_tensor(self.read_audio(audio_file))
+        return self.save_stems(stems, output_dir)
+
+
+class AudioBuffer:
+    """Audio decoded once, converted to other rates/channel counts on demand.
+
+    Each conversion is computed the first time it's asked for and then
+    shared, so analysis, separation and drumsep never decode the file again.
+    """
+
+    def __init__(self, wav, samplerate):
+        self.wav = wav
+        self.samplerate = samplerate
+        self._conversions = {(samplerate, wav.shape[0]): wav}
+
+    @property
+    def duration(self):
+        return self.wav.shape[-1] / self.samplerate
+
+    def at(self, samplerate, channels):
+        """Return the audio as a (channels, samples) tensor at samplerate."""
+        key = (samplerate, channels)
+        if key not in self._conversions:
+            from demucs.audio import convert_audio
+
+            self._conversions[key] = convert_audio(self.wav, self.samplerate, samplerate, channels)
+        return self._conversions[key]
+
+
+def configure_threads(intra_op_threads, inter_op_threads=None):
+    """Set how many CPU threads torch may use in this process."""
+    import torch
+
+    if intra_op_threads:
+        torch.set_num_threads(int(intra_op_threads))
+    if inter_op_threads:
+        try:
+            torch.set_num_interop_threads(int(inter_op_threads))
+        except RuntimeError:
+            # Can only be set before torch starts any parallel work
+            pass
+
+
+_engines = {}
+
+
+def _engine_key(model_name, repo, device):
+    return (model_name, str(Path(repo).resolve()) if repo else None, device)
+
+
+def get_engine(model_name, repo=None, device="cpu"):
+    """Return the shared engine for a model, creating it on first use."""
+    key = _engine_key(model_name, repo, device)
+    if key not in _engines:
+        _engines[key] = DemucsEngine(model_name, repo=repo, device=device)
+    return _engines[key]
+
+
+def register_engine(engine):
+    """Make get_engine() return this engine for its model (e.g. a stand-in for benchmarks)."""
+    _engines[_engine_key(engine.model_name, engine.repo, engine.device)] = engine
@@ -1,52 +1,133 @@
 #!/usr/bin/env python3
+import argparse
+import multiprocessing
 import os
 import sys
-import subprocess
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
 from pathlib import Path
 
-def separate_drums(input_path, output_path):
+# demucs_engine lives in the project root, one level up from this script
+ROOT_DIR = str(Path(__file__).resolve().parent.parent)
+if ROOT_DIR not in sys.path:
+    sys.path.insert(0, ROOT_DIR)
+
+from demucs_engine import SeparationError, configure_threads, get_engine
+
+MODEL_ID = "49469ca8"
+AUDIO_EXTENSIONS = (".mp3", ".wav", ".ogg", ".flac")
+
+def get_drum_engine():
+    """Return the shared engine for the drum model shipped in ./model."""
+    model_dir = Path(__file__).parent.absolute() / "model"
+    return get_engine(MODEL_ID, repo=model_dir)
+
+def find_audio_files(input_path):
+    """Return the audio files in a directory (sorted), or the path itself if it's a file."""
     input_path = Path(input_path)
-    output_path = Path(output_path)
-    
-    # Create output directory if it doesn't exist
-    output_path.mkdir(exist_ok=True)
-    
-    # Get the location of the script and model
-    script_dir = Path(__file__).parent.absolute()
-    model_dir = script_dir / "model"
-    
-    if input_path.is_dir():
-        # Process all audio files in directory
-        audio_extensions = [".mp3", ".wav", ".ogg", ".flac"]
-        audio_files = []
-        
-        for ext in audio_extensions:
-            audio_files.extend(list(input_path.glob(f"*{ext}")))
-        
-        for audio_file in audio_files:
-            run_demucs(audio_file, output_path, model_dir)
-    else:
-        # Process single file
-        run_demucs(input_path, output_path, model_dir)
-    
-    return True
-
-def run_demucs(audio_file, output_path, model_dir):
+    if not input_path.is_dir():
+        return [input_path]
+    return sorted(path for path in input_path.iterdir()
+                  if path.is_file() and path.suffix.lower() in AUDIO_EXTENSIONS)
+
+def separate_drums(input_path, output_path, workers=1):
+    """Split one drum file or every drum file in a directory.
+
+    Returns True only if every file was separated.
+    """
+    audio_files = find_audio_files(input_path)
+    if not audio_files:
+        print(f"No audio files found in {input_path}")
+        return False
+
+    results = separate_drums_batch(audio_files, output_path, workers)
+    failed = {path: error for path, error in results.items() if error}
+    print(f"Separated {len(results) - len(failed)} of {len(results)} files")
+    for path, error in failed.items():
+        print(f"  Failed: {path}: {error}")
+    return not failed
+
+def separate_drums_batch(audio_files, output_path, workers=1):
+    """Split a list of drum files with the model loaded once per process.
+
+    Returns {file: None on success or an error message}, in input order.
+    """
+    Path(output_path).mkdir(parents=True, exist_ok=True)
+    audio_files = [str(path) for path in audio_files]
+    workers = max(1, min(workers, len(audio_files)))
+
+    if workers == 1:
+        engine = get_drum_engine()
+        return {audio_file: _separate_one(audio_file, output_path, engine) for audio_file in audio_files}
+
+    # Spawned workers each load the model once and share the CPU cores evenly
+    threads = max(1, (os.cpu_count() or 1) // workers)
+    context = multiprocessing.get_context("spawn")
+    with ProcessPoolExecutor(max_workers=workers, mp_context=context,
+                             initializer=_init_worker, initargs=(threads,)) as pool:
+        errors = pool.map(_separate_in_worker, audio_files, [str(output_path)] * len(audio_files))
+        return dict(zip(audio_files, errors))
+
+def _separate_one(audio_file, output_path, engine):
+    try:
+        run_demucs(audio_file, output_path, engine)
+        return None
+    except Exception as e:
+        print(f"Error processing {audio_file}: {e}")
+        return str(e)
+
+def _init_worker(threads):
+    configure_threads(threads)
+    get_drum_engine().load()
+
+def _separate_in_worker(audio_file, output_path):
+    return _separate_one(audio_file, output_path, get_drum_engine())
+
+def separate_drums_tensor(drums, samplerate):
+    """Split an in-memory drums stem into {part: tensor} without touching disk.
+
+    The parts come back at the same sample rate as the input.
+    """
+    engine = get_drum_engine()
+    parts = engine.separate_tensor(engine.resample(drums, samplerate))
+    if engine.samplerate != samplerate:
+        from demucs.audio import convert_audio
+        parts = {name: convert_audio(part, engine.samplerate, samplerate, part.shape[0])
+                 for name, part in parts.items()}
+    return parts
+
+def separate_drums_streaming(drums_file, output_path, segment_seconds=60, overlap_seconds=2,
+                             output_format="wav16", compression_level=None):
+    """Split a long drums file segment by segment into {part: path} files."""
+    engine = get_drum_engine()
+    return engine.separate_file_streaming(drums_file, output_path, segment_seconds, overlap_seconds,
+                                          output_format=output_format, compression_level=compression_level)
+
+def run_demucs(audio_file, output_path, engine):
     print(f"Processing {audio_file}...")
-    
-    # Run demucs with the drum model
-    subprocess.run([
-        "demucs", 
-        "--repo", str(model_dir),
-        "-o", str(output_path),
-        "-n", "49469ca8", 
-        str(audio_file)
-    ])
+
+    # Same layout as the demucs CLI: {output}/{model}/{track}/{source}.wav
+    track_dir = Path(output_path) / MODEL_ID / Path(audio_file).stem
+    return engine.separate_file(audio_file, track_dir)
 
 if __name__ == "__main__":
-    if len(sys.argv) != 3:
-        print("Usage: python drumsep.py <input_path> <output_path>")
-        sys.exit(1)
-    
-    success = separate_drums(sys.argv[1], sys.argv[2])
-    sys.exit(0 if success else 1)
\ No newline at end of file
+    parser = argparse.ArgumentParser(description="Split drum recordings into kick, snare, cymbals and toms")
+    parser.add_argument("input_path", help="Audio file or directory of audio files")
+    parser.add_argument("output_path", help="Directory for the separated parts")
+    parser.add_argument("-j", "--jobs", type=int, default=1,
+                        help="Worker processes, each with its own copy of the model (default: 1)")
+    args = parser.parse_args()
+
+    try:
+        success = separate_drums(args.input_path, args.output_path, args.jobs)
+    except SeparationError as e:
+        print(f"Error: {e}")
+        success = False
+    except BrokenProcessPool as e:
+        # A worker died (e.g. out of memory) and took the rest of the batch with it
+        print(f"Error: worker process died: {e}")
+        success = False
+    except OSError as e:
+        print(f"Error: {e}")
+        success = False
+    sys.exit(0 if success else 1)
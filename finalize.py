@@ -0,0 +1,87 @@
+#!/usr/bin/env python3
+"""Put finished files in place without writing their bytes twice.
+
+Files are renamed or hardlinked into place when source and destination are
+on the same filesystem, and only copied across devices. Everything is first
+written under a temporary name next to its destination and then swapped in
+with os.replace, so a crash never leaves a half-written file behind.
+"""
+import errno
+import os
+import shutil
+
+
+def partial_path(dest):
+    """Temporary name next to dest, keeping the extension so writers pick the right format."""
+    folder, name = os.path.split(dest)
+    base, ext = os.path.splitext(name)
+    return os.path.join(folder, f".{base}.{os.getpid()}.partial{ext}")
+
+
+def _remove(path):
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
+
+
+def link_or_copy(source, dest):
+    """Hardlink source to dest, falling back to a copy if linking isn't possible."""
+    tmp = partial_path(dest)
+    _remove(tmp)
+    try:
+        try:
+            os.link(source, tmp)
+        except OSError:
+            # Different device, or a filesystem without hardlinks
+            shutil.copy2(source, tmp)
+        os.replace(tmp, dest)
+    except BaseException:
+        _remove(tmp)
+        raise
+
+
+def move_file(source, dest):
+    """Rename source to dest, copying only when they're on different devices."""
+    try:
+        os.replace(source, dest)
+        return
+    except OSError as e:
+        if e.errno != errno.EXDEV:
+            raise
+    link_or_copy(source, dest)
+    _remove(source)
+
+
+class Finalizer:
+    """Places one song's output files and can remove them again if the run fails."""
+
+    def __init__(self):
+        self.placed = []
+
+    def write(self, dest, write_fn):
+        """Call write_fn(tmp_path) and move the result to dest once it's complete."""
+        tmp = partial_path(dest)
+        try:
+            write_fn(tmp)
+            os.replace(tmp, dest)
+        except BaseException:
+            _remove(tmp)
+            raise
+        self.placed.append(dest)
+
+    def link(self, source, dest):
+        """Put a file at dest while keeping source (e.g. a cache entry)."""
+        link_or_copy(source, dest)
+        self.placed.append(dest)
+
+    def move(self, source, dest):
+        """Put a file at dest that's no longer needed at source (e.g. temp output)."""
+        move_file(source, dest)
+        self.placed.append(dest)
+
+    def rollback(self):
+        """Remove every file placed so far."""
+        for path in reversed(self.placed):
+            _remove(path)
+        self.placed = []
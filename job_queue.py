@@ -0,0 +1,142 @@
+#!/usr/bin/env python3
+"""Persistent job queue for the watch-folder daemon, stored in SQLite.
+
+Every job keeps its status, priority, attempt count and timings, so a
+restarted daemon picks up queued work and retries jobs that were running
+when it stopped. Failed jobs are retried with exponential backoff.
+"""
+import os
+import sqlite3
+import threading
+import time
+
+QUEUED = "queued"
+RUNNING = "running"
+DONE = "done"
+FAILED = "failed"
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    input_file TEXT NOT NULL,
+    fingerprint TEXT NOT NULL UNIQUE,
+    status TEXT NOT NULL DEFAULT 'queued',
+    priority INTEGER NOT NULL DEFAULT 0,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    next_attempt_at REAL NOT NULL DEFAULT 0,
+    created_at REAL NOT NULL,
+    started_at REAL,
+    finished_at REAL,
+    output_dir TEXT,
+    error TEXT
+);
+CREATE INDEX IF NOT EXISTS jobs_ready ON jobs (status, priority DESC, id);
+"""
+
+
+def file_fingerprint(path):
+    """Path, size and mtime: a changed file counts as a new job."""
+    stat = os.stat(path)
+    return f"{os.path.abspath(path)}:{stat.st_size}:{stat.st_mtime_ns}"
+
+
+class JobQueue:
+    """Songs waiting to be split, highest priority first, then oldest first."""
+
+    def __init__(self, db_path, max_attempts=3, retry_delay_seconds=30):
+        os.makedirs(os.path.dirname(os.path.abspath(db_path)), exist_ok=True)
+        self.max_attempts = max_attempts
+        self.retry_delay_seconds = retry_delay_seconds
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(db_path, check_same_thread=False, isolation_level=None)
+        self._db.row_factory = sqlite3.Row
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.executescript(SCHEMA)
+
+    def _execute(self, sql, params=()):
+        with self._lock:
+            return self._db.execute(sql, params)
+
+    def enqueue(self, input_file, priority=0):
+        """Add a file; returns the job id, or None if this exact file was already queued."""
+        with self._lock:
+            cursor = self._db.execute(
+                "INSERT OR IGNORE INTO jobs (input_file, fingerprint, priority, created_at) VALUES (?, ?, ?, ?)",
+                (os.path.abspath(input_file), file_fingerprint(input_file), priority, time.time())
+            )
+            return cursor.lastrowid if cursor.rowcount else None
+
+    def claim(self):
+        """Mark the next ready job as running and return it, or None if nothing is ready."""
+        now = time.time()
+        with self._lock:
+            # IMMEDIATE takes the write lock up front so two daemons can't claim the same job
+            self._db.execute("BEGIN IMMEDIATE")
+            try:
+                job = self._db.execute(
+                    "SELECT * FROM jobs WHERE status = ? AND next_attempt_at <= ? "
+                    "ORDER BY priority DESC, id LIMIT 1",
+                    (QUEUED, now)
+                ).fetchone()
+                if job:
+                    self._db.execute(
+                        "UPDATE jobs SET status = ?, attempts = attempts + 1, started_at = ? WHERE id = ?",
+                        (RUNNING, now, job["id"])
+                    )
+                self._db.execute("COMMIT")
+            except BaseException:
+                self._db.execute("ROLLBACK")
+                raise
+        return self.get(job["id"]) if job else None
+
+    def finish(self, job_id, output_dir):
+        self._execute(
+            "UPDATE jobs SET status = ?, finished_at = ?, output_dir = ?, error = NULL WHERE id = ?",
+            (DONE, time.time(), output_dir, job_id)
+        )
+
+    def fail(self, job_id, error):
+        """Record a failure; the job is retried later unless it's out of attempts.
+
+        Returns True if the job will be retried.
+        """
+        job = self.get(job_id)
+        if job["attempts"] < self.max_attempts:
+            # Back off exponentially: 1x, 2x, 4x ... the base delay
+            delay = self.retry_delay_seconds * 2 ** (job["attempts"] - 1)
+            self._execute(
+                "UPDATE jobs SET status = ?, error = ?, next_attempt_at = ? WHERE id = ?",
+                (QUEUED, error, time.time() + delay, job_id)
+            )
+            return True
+        self._execute(
+            "UPDATE jobs SET status = ?, error = ?, finished_at = ? WHERE id = ?",
+            (FAILED, error, time.time(), job_id)
+        )
+        return False
+
+    def release(self, job_id):
+        """Put a running job back without counting the attempt (e.g. on shutdown)."""
+        self._execute(
+            "UPDATE jobs SET status = ?, attempts = MAX(attempts - 1, 0) WHERE id = ? AND status = ?",
+            (QUEUED, job_id, RUNNING)
+        )
+
+    def recover(self):
+        """Requeue jobs left running by a daemon that died; returns how many."""
+        return self._execute(
+            "UPDATE jobs SET status = ?, next_attempt_at = 0 WHERE status = ?", (QUEUED, RUNNING)
+        ).rowcount
+
+    def get(self, job_id):
+        row = self._execute("SELECT * FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        return dict(row) if row else None
+
+    def counts(self):
+        """Number of jobs per status."""
+        rows = self._execute("SELECT status, COUNT(*) AS n FROM jobs GROUP BY status").fetchall()
+        return {row["status"]: row["n"] for row in rows}
+
+    def close(self):
+        with self._lock:
+            self._db.close()
@@ -0,0 +1,387 @@
+#!/usr/bin/env python3
+"""Local HTTP API for submitting songs to a pool of warm worker processes.
+
+Endpoints (all JSON unless noted):
+    POST /jobs?filename=song.mp3[&priority=N]  upload raw audio bytes as the body
+    GET  /jobs/<id>                            status, progress events and stem names
+    GET  /jobs/<id>/events                     progress as Server-Sent Events
+    GET  /jobs/<id>/stems/<file name>          download one output file (WAV or FLAC audio)
+    GET  /health                               worker count and queue depth
+
+Each worker process loads the models once at start-up. Uploads are refused
+with 503 and a Retry-After header once queue_depth songs are already
+waiting, so overload pushes back on the client instead of piling up work.
+Only the newest keep_finished_jobs finished jobs are remembered; older ones
+are forgotten and their output folders deleted.
+"""
+import copy
+import json
+import multiprocessing
+import os
+import shutil
+import threading
+import time
+import uuid
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, unquote, urlsplit
+
+FINISHED = ("done", "failed")
+
+CONTENT_TYPES = {".wav": "audio/wav", ".flac": "audio/flac"}
+
+
+class Overloaded(Exception):
+    """Raised when the queue is full and a job can't be admitted."""
+
+
+class JobServer:
+    """Tracks jobs and runs them on a fixed pool of worker processes.
+
+    run_job(job_id, input_file, config) runs in a worker, with a copy of
+    config whose output_dir is unique to the job, and returns (output_dir,
+    error, report). init_worker(threads, events, config) runs once per
+    worker; progress events it puts on the events queue must carry
+    the job id under "job".
+    """
+
+    def __init__(self, config, run_job, init_worker, workers, threads):
+        settings = config["server"]
+        self.config = config
+        self.run_job = run_job
+        self.init_worker = init_worker
+        self.workers = workers
+        self.threads = threads
+        self.queue_depth = settings["queue_depth"]
+        self.max_upload_bytes = int(settings["max_upload_mb"] * 1024 * 1024)
+        self.keep_finished = settings["keep_finished_jobs"]
+        self.upload_dir = os.path.join(config["paths"]["temp_dir"], "uploads")
+        self.jobs = {}
+        # Reentrant because a future that's already done runs its callback inside submit()
+        self.lock = threading.RLock()
+        self.changed = threading.Condition(self.lock)
+        self.context = multiprocessing.get_context("spawn")
+        self.events = self.context.Queue()
+        self.pool = None
+        self.in_flight = 0
+
+    def start(self):
+        self.pool = self._start_pool()
+        threading.Thread(target=self._collect_events, daemon=True).start()
+
+    def stop(self):
+        self.events.put(None)
+        self.pool.shutdown(wait=False)
+
+    def _start_pool(self):
+        return ProcessPoolExecutor(max_workers=self.workers, mp_context=self.context,
+                                   initializer=self.init_worker,
+                                   initargs=(self.threads, self.events, self.config))
+
+    def _add_event(self, job, event):
+        """Append an event to a job's log and wake up anyone streaming it. Call with the lock held."""
+        event = dict(event, seq=len(job["events"]), time=time.time())
+        event.pop("job", None)
+        job["events"].append(event)
+        self.changed.notify_all()
+
+    def _collect_events(self):
+        while True:
+            event = self.events.get()
+            if event is None:
+                return
+            with self.lock:
+                job = self.jobs.get(event.get("job"))
+                if job is None:
+                    continue
+                if event["event"] == "started" and job["status"] == "queued":
+                    job["status"] = "running"
+                    job["started"] = time.time()
+                self._add_event(job, event)
+
+    def counts(self):
+        with self.lock:
+            statuses = [job["status"] for job in self.jobs.values()]
+        return {status: statuses.count(status) for status in ("uploading", "queued", "running", "done", "failed")}
+
+    def admit(self, filename, priority=0):
+        """Reserve a place for a new job, or raise Overloaded if too many are waiting."""
+        with self.lock:
+            waiting = sum(job["status"] == "uploading" or (job["status"] == "queued" and not job["dispatched"])
+                          for job in self.jobs.values())
+            if waiting >= self.queue_depth:
+                raise Overloaded(f"{waiting} job(s) already waiting")
+            job_id = uuid.uuid4().hex[:12]
+            name = os.path.basename(filename) or "upload.wav"
+            # Uploads with the same file name must not share (and overwrite) an output folder
+            config = copy.deepcopy(self.config)
+            config["paths"]["output_dir"] = os.path.join(self.config["paths"]["output_dir"], job_id)
+            job = {
+                "id": job_id, "filename": name, "priority": priority, "status": "uploading",
+                "input_file": os.path.join(self.upload_dir, job_id, name), "config": config,
+                "created": time.time(), "started": None, "finished": None,
+                "output_dir": None, "stems": {}, "error": None, "report": None, "events": [],
+                "dispatched": False,
+            }
+            self.jobs[job_id] = job
+        return job
+
+    def submit(self, job):
+        """Queue an uploaded job for the worker pool."""
+        with self.lock:
+            job["status"] = "queued"
+            self._add_event(job, {"event": "queued"})
+            self._dispatch()
+
+    def _dispatch(self):
+        """Start the highest-priority queued jobs on free workers. Call with the lock held.
+
+        Jobs stay in our own queue until a worker is free, so priorities
+        apply and the pool never holds a backlog of its own.
+        """
+        while self.in_flight < self.workers:
+            queued = [job for job in self.jobs.values() if job["status"] == "queued" and not job["dispatched"]]
+            if not queued:
+                return
+            job = min(queued, key=lambda job: (-job["priority"], job["created"]))
+            job["dispatched"] = True
+            self.in_flight += 1
+            try:
+                future = self.pool.submit(self.run_job, job["id"], job["input_file"], job["config"])
+            except BrokenProcessPool:
+                self.pool = self._start_pool()
+                future = self.pool.submit(self.run_job, job["id"], job["input_file"], job["config"])
+            pool = self.pool
+            future.add_done_callback(lambda f, job=job, pool=pool: self._job_done(job, pool, f))
+
+    def discard(self, job):
+        """Forget a job whose upload didn't complete."""
+        with self.lock:
+            self.jobs.pop(job["id"], None)
+        shutil.rmtree(os.path.dirname(job["input_file"]), ignore_errors=True)
+
+    def _job_done(self, job, pool, future):
+        error = future.exception()
+        if isinstance(error, BrokenProcessPool):
+            with self.lock:
+                # A worker died (e.g. out of memory); replace the pool once
+                if self.pool is pool:
+                    self.pool = self._start_pool()
+        if error is None:
+            output_dir, error, report = future.result()
+        elif isinstance(error, BrokenProcessPool):
+            output_dir, error, report = None, f"Worker process died: {error}", None
+        else:
+            output_dir, error, report = None, str(error), None
+
+        with self.lock:
+            job["finished"] = time.time()
+            job["output_dir"] = output_dir
+            job["error"] = error
+            job["report"] = report
+            if report:
+                job["stems"] = {os.path.basename(path): path
+                                for path in report["info"].get("output_files", [])}
+            job["status"] = "failed" if error else "done"
+            self._add_event(job, {"event": job["status"], "error": error})
+            self.in_flight -= 1
+            self._dispatch()
+            expired = self._expire_finished()
+        shutil.rmtree(os.path.dirname(job["input_file"]), ignore_errors=True)
+        for old_job in expired:
+            shutil.rmtree(old_job["config"]["paths"]["output_dir"], ignore_errors=True)
+
+    def _expire_finished(self):
+        """Forget all but the newest keep_finished finished jobs and return the others. Call with the lock held."""
+        finished = sorted((job for job in self.jobs.values() if job["status"] in FINISHED),
+                          key=lambda job: job["finished"])
+        expired = finished[:max(0, len(finished) - self.keep_finished)]
+        for job in expired:
+            del self.jobs[job["id"]]
+        return expired
+
+    def describe(self, job_id):
+        with self.lock:
+            job = self.jobs.get(job_id)
+            if job is None:
+                return None
+            position = None
+            if job["status"] == "queued" and not job["dispatched"]:
+                ahead = (-job["priority"], job["created"])
+                position = sum(other["status"] == "queued" and not other["dispatched"]
+                               and (-other["priority"], other["created"]) < ahead
+                               for other in self.jobs.values())
+            return {
+                "id": job["id"], "filename": job["filename"], "status": job["status"],
+                "queue_position": position, "created": job["created"], "started": job["started"],
+                "finished": job["finished"], "output_dir": job["output_dir"], "error": job["error"],
+                "stems": sorted(job["stems"]), "events": list(job["events"]),
+            }
+
+    def wait_for_events(self, job_id, after, timeout):
+        """Block until job_id has more than `after` events or is finished.
+
+        Returns (new events, finished), or None for an unknown job.
+        """
+        with self.changed:
+            job = self.jobs.get(job_id)
+            if job is None:
+                return None
+            if len(job["events"]) <= after and job["status"] not in FINISHED:
+                self.changed.wait(timeout)
+            return job["events"][after:], job["status"] in FINISHED
+
+    def stem_path(self, job_id, name):
+        with self.lock:
+            job = self.jobs.get(job_id)
+            return job["stems"].get(name) if job else None
+
+
+class JobRequestHandler(BaseHTTPRequestHandler):
+    server_version = "BestStemSplitterEver"
+
+    @property
+    def jobs(self):
+        return self.server.jobs
+
+    def send_json(self, status, data, headers=None):
+        body = json.dumps(data, indent=2).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def route(self):
+        url = urlsplit(self.path)
+        return [unquote(part) for part in url.path.strip("/").split("/")], parse_qs(url.query)
+
+    def do_GET(self):
+        parts, _ = self.route()
+        if parts == ["health"]:
+            self.send_json(200, dict(self.jobs.counts(), workers=self.jobs.workers,
+                                     queue_depth=self.jobs.queue_depth))
+        elif len(parts) == 2 and parts[0] == "jobs":
+            job = self.jobs.describe(parts[1])
+            if job is None:
+                self.send_json(404, {"error": "no such job"})
+            else:
+                self.send_json(200, job)
+        elif len(parts) == 3 and parts[0] == "jobs" and parts[2] == "events":
+            self.stream_events(parts[1])
+        elif len(parts) == 4 and parts[0] == "jobs" and parts[2] == "stems":
+            self.send_stem(parts[1], parts[3])
+        else:
+            self.send_json(404, {"error": "not found"})
+
+    def do_POST(self):
+        parts, query = self.route()
+        if parts != ["jobs"]:
+            self.send_json(404, {"error": "not found"})
+            return
+
+        filename = query.get("filename", [None])[0] or self.headers.get("X-Filename")
+        if not filename:
+            self.send_json(400, {"error": "pass the file name as ?filename=song.mp3"})
+            return
+        try:
+            length = int(self.headers.get("Content-Length", ""))
+        except ValueError:
+            self.send_json(411, {"error": "Content-Length is required"})
+            return
+        try:
+            priority = int(query.get("priority", [0])[0])
+        except ValueError:
+            self.send_json(400, {"error": "priority must be an integer"})
+            return
+        if length > self.jobs.max_upload_bytes:
+            self.send_json(413, {"error": f"upload larger than {self.jobs.max_upload_bytes} bytes"})
+            return
+
+        # Decide before reading the body so a full queue doesn't cost an upload
+        try:
+            job = self.jobs.admit(filename, priority)
+        except Overloaded as e:
+            self.send_json(503, {"error": f"server busy: {e}"}, {"Retry-After": "10"})
+            self.close_connection = True
+            return
+
+        try:
+            os.makedirs(os.path.dirname(job["input_file"]), exist_ok=True)
+            with open(job["input_file"], 'wb') as f:
+                remaining = length
+                while remaining:
+                    chunk = self.rfile.read(min(remaining, 1024 * 1024))
+                    if not chunk:
+                        raise ConnectionError("upload ended early")
+                    f.write(chunk)
+                    remaining -= len(chunk)
+        except (OSError, ConnectionError) as e:
+            self.jobs.discard(job)
+            self.send_json(400, {"error": f"upload failed: {e}"})
+            return
+
+        self.jobs.submit(job)
+        self.send_json(202, self.jobs.describe(job["id"]), {"Location": f"/jobs/{job['id']}"})
+
+    def stream_events(self, job_id):
+        if self.jobs.describe(job_id) is None:
+            self.send_json(404, {"error": "no such job"})
+            return
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Cache-Control", "no-cache")
+        self.end_headers()
+        sent = 0
+        try:
+            while True:
+                events, finished = self.jobs.wait_for_events(job_id, sent, timeout=15)
+                if not events and not finished:
+                    # Keep idle connections (and proxies) from timing out
+                    self.wfile.write(b": keep-alive\n\n")
+                for event in events:
+                    self.wfile.write(f"id: {event['seq']}\nevent: {event['event']}\n"
+                                     f"data: {json.dumps(event)}\n\n".encode())
+                self.wfile.flush()
+                sent += len(events)
+                if finished and not events:
+                    break
+        except (BrokenPipeError, ConnectionResetError):
+            pass
+        self.close_connection = True
+
+    def send_stem(self, job_id, name):
+        path = self.jobs.stem_path(job_id, name)
+        if path is None or not os.path.exists(path):
+            self.send_json(404, {"error": "no such stem"})
+            return
+        self.send_response(200)
+        content_type = CONTENT_TYPES.get(os.path.splitext(name)[1].lower(), "application/octet-stream")
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(os.path.getsize(path)))
+        self.send_header("Content-Disposition", f'attachment; filename="{name}"')
+        self.end_headers()
+        with open(path, 'rb') as f:
+            shutil.copyfileobj(f, self.wfile)
+
+
+def serve(config, run_job, init_worker, workers, threads):
+    """Run the HTTP API until interrupted."""
+    settings = config["server"]
+    jobs = JobServer(config, run_job, init_worker, workers, threads)
+    httpd = ThreadingHTTPServer((settings["host"], settings["port"]), JobRequestHandler)
+    httpd.daemon_threads = True
+    httpd.jobs = jobs
+    jobs.start()
+    print(f"🌐 Listening on http://{settings['host']}:{settings['port']} "
+          f"with {workers} worker(s), {threads} thread(s) each (Ctrl+C to stop)")
+    try:
+        httpd.serve_forever()
+    except KeyboardInterrupt:
+        print("\n🛑 Stopping server")
+    finally:
+        httpd.server_close()
+        jobs.stop()
@@ -0,0 +1,165 @@
+#!/usr/bin/env python3
+"""Key/BPM index of the music library, stored in SQLite.
+
+Every analyzed song gets a row with its key, Camelot code, tempo, duration
+and the stems that were written for it, keyed by path and content hash.
+Harmonic-mix queries ("what fits with 8A at 124 BPM?") are answered from
+the index instead of re-analyzing or parsing file names, and rescans only
+analyze files whose size, mtime and content changed.
+"""
+import json
+import os
+import sqlite3
+import threading
+import time
+
+from checkpoint import file_checksum
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS tracks (
+    path TEXT PRIMARY KEY,
+    size INTEGER NOT NULL,
+    mtime_ns INTEGER NOT NULL,
+    content_hash TEXT NOT NULL,
+    key TEXT,
+    camelot TEXT,
+    bpm REAL,
+    duration REAL,
+    stems TEXT NOT NULL DEFAULT '[]',
+    output_dir TEXT,
+    analysis_mode TEXT,
+    indexed_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS tracks_camelot_bpm ON tracks (camelot, bpm);
+CREATE INDEX IF NOT EXISTS tracks_hash ON tracks (content_hash);
+"""
+
+# Columns copied to a new path when the same audio turns up elsewhere
+ANALYSIS_COLUMNS = ("key", "camelot", "bpm", "duration", "stems", "output_dir", "analysis_mode")
+
+
+def compatible_keys(camelot):
+    """Camelot codes that mix with camelot: itself, one step either way, and its relative major/minor."""
+    number, mode = int(camelot[:-1]), camelot[-1].upper()
+    other_mode = "B" if mode == "A" else "A"
+    return [f"{number}{mode}", f"{(number - 2) % 12 + 1}{mode}", f"{number % 12 + 1}{mode}",
+            f"{number}{other_mode}"]
+
+
+class LibraryIndex:
+    """Analysis results for every known track, queryable by Camelot code and BPM."""
+
+    def __init__(self, db_path):
+        os.makedirs(os.path.dirname(os.path.abspath(db_path)), exist_ok=True)
+        self._lock = threading.Lock()
+        # Batch workers write from separate processes, so wait for each other's writes
+        self._db = sqlite3.connect(db_path, timeout=30, check_same_thread=False, isolation_level=None)
+        self._db.row_factory = sqlite3.Row
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.executescript(SCHEMA)
+
+    def _execute(self, sql, params=()):
+        with self._lock:
+            return self._db.execute(sql, params)
+
+    def get(self, path):
+        row = self._execute("SELECT * FROM tracks WHERE path = ?", (os.path.abspath(path),)).fetchone()
+        return self._to_dict(row)
+
+    def refresh(self, path):
+        """Bring a file's entry up to date without analysis where possible.
+
+        Unchanged size and mtime mean the entry is current, unless its key
+        analysis failed. Otherwise the file is hashed: if the content is
+        already indexed (touched, moved or copied), that analysis is reused.
+        Returns None if the entry is now current, or the content hash if the
+        file needs analyzing.
+        """
+        path = os.path.abspath(path)
+        stat = os.stat(path)
+        row = self._execute("SELECT * FROM tracks WHERE path = ?", (path,)).fetchone()
+        # An entry without a key (analysis failed) is analyzed again
+        if row and row["camelot"] is None:
+            row = None
+        if row and row["size"] == stat.st_size and row["mtime_ns"] == stat.st_mtime_ns:
+            return None
+        content_hash = file_checksum(path)
+        if not (row and row["content_hash"] == content_hash):
+            row = self._execute(
+                "SELECT * FROM tracks WHERE content_hash = ? AND camelot IS NOT NULL LIMIT 1", (content_hash,)
+            ).fetchone()
+        if row is None:
+            return content_hash
+        self._upsert(path, stat, content_hash, {name: row[name] for name in ANALYSIS_COLUMNS})
+        return None
+
+    def record(self, path, key, camelot, bpm, duration=None, stems=(), output_dir=None,
+               analysis_mode=None, content_hash=None):
+        """Store the analysis of a file, replacing whatever was indexed for its path."""
+        path = os.path.abspath(path)
+        self._upsert(path, os.stat(path), content_hash or file_checksum(path), {
+            "key": key,
+            "camelot": camelot or None,
+            "bpm": bpm or None,
+            "duration": duration,
+            "stems": json.dumps(sorted(stems)),
+            "output_dir": output_dir,
+            "analysis_mode": analysis_mode,
+        })
+
+    def _upsert(self, path, stat, content_hash, analysis):
+        columns = ["path", "size", "mtime_ns", "content_hash", "indexed_at"] + list(analysis)
+        values = [path, stat.st_size, stat.st_mtime_ns, content_hash, time.time()] + list(analysis.values())
+        self._execute(
+            f"INSERT OR REPLACE INTO tracks ({', '.join(columns)}) VALUES ({', '.join('?' * len(columns))})",
+            values
+        )
+
+    def query(self, camelot=None, bpm=None, bpm_range=3, limit=None):
+        """Tracks in a key compatible with camelot and within bpm_range of bpm.
+
+        Either filter can be left out. Exact key matches come first, then
+        the closest tempo.
+        """
+        where, params = ["camelot IS NOT NULL"], []
+        if camelot:
+            keys = compatible_keys(camelot)
+            where.append(f"camelot IN ({', '.join('?' * len(keys))})")
+            params += keys
+        if bpm:
+            where.append("bpm BETWEEN ? AND ?")
+            params += [bpm - bpm_range, bpm + bpm_range]
+        sql = (f"SELECT * FROM tracks WHERE {' AND '.join(where)} "
+               f"ORDER BY camelot != ?, ABS(bpm - ?), path")
+        params += [camelot.upper() if camelot else "", bpm or 0]
+        if limit:
+            sql += " LIMIT ?"
+            params.append(limit)
+        return [self._to_dict(row) for row in self._execute(sql, params).fetchall()]
+
+    def prune(self, folder):
+        """Drop entries under folder whose files no longer exist; returns how many."""
+        prefix = os.path.join(os.path.abspath(folder), "")
+        rows = self._execute(
+            "SELECT path FROM tracks WHERE substr(path, 1, ?) = ?", (len(prefix), prefix)
+        ).fetchall()
+        missing = [(row["path"],) for row in rows if not os.path.exists(row["path"])]
+        if missing:
+            with self._lock:
+                self._db.executemany("DELETE FROM tracks WHERE path = ?", missing)
+        return len(missing)
+
+    def count(self):
+        return self._execute("SELECT COUNT(*) FROM tracks").fetchone()[0]
+
+    @staticmethod
+    def _to_dict(row):
+        if row is None:
+            return None
+        track = dict(row)
+        track["stems"] = json.loads(track["stems"])
+        return track
+
+    def close(self):
+        with self._lock:
+            self._db.close()
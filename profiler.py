@@ -0,0 +1,166 @@
+#!/usr/bin/env python3
+"""Per-stage timing, memory and real-time-factor instrumentation.
+
+A RunProfiler records wall time, CPU time and peak RSS for each pipeline
+stage of one song and turns them into a JSON-friendly report. The real-time
+factor (RTF) is processing time divided by audio duration, so lower is
+better and 1.0 means "as long as the song itself".
+"""
+import json
+import os
+import sys
+import threading
+import time
+from contextlib import contextmanager
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+
+def _reset_peak_rss():
+    """Reset the kernel's peak-RSS counter so each stage gets its own peak (Linux only)."""
+    try:
+        with open("/proc/self/clear_refs", "w") as f:
+            f.write("5")
+        return True
+    except OSError:
+        return False
+
+
+def peak_rss_mb():
+    """Peak resident memory of this process in MB, or None if unavailable."""
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is in bytes on macOS and kilobytes elsewhere
+    return peak / (1024 * 1024) if sys.platform == "darwin" else peak / 1024
+
+
+def _rtf(seconds, audio_seconds):
+    return round(seconds / audio_seconds, 4) if audio_seconds else None
+
+
+class RunProfiler:
+    """Collects stage measurements for one song (or one run)."""
+
+    def __init__(self, name, enabled=True, on_event=None):
+        self.name = name
+        self.enabled = enabled
+        # Called with {"event": "stage_started"/"stage_finished", "stage": ...} for progress reporting
+        self.on_event = on_event
+        self.audio_seconds = None
+        self.info = {}
+        self.stages = []
+        self.started = time.perf_counter()
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def stage(self, name, background=False):
+        """Measure the enclosed block as a pipeline stage.
+
+        Background stages run on another thread next to the main pipeline;
+        they report that thread's CPU time and don't reset the peak-RSS counter.
+        Stages entered from any thread other than the main one count as background.
+        """
+        background = background or threading.current_thread() is not threading.main_thread()
+        if self.on_event:
+            self.on_event({"event": "stage_started", "stage": name})
+        if not self.enabled:
+            try:
+                yield
+            finally:
+                if self.on_event:
+                    self.on_event({"event": "stage_finished", "stage": name})
+            return
+
+        if not background:
+            _reset_peak_rss()
+        cpu_clock = time.thread_time if background else time.process_time
+        wall_start, cpu_start = time.perf_counter(), cpu_clock()
+        try:
+            yield
+        finally:
+            record = {
+                "stage": name,
+                "wall_seconds": round(time.perf_counter() - wall_start, 4),
+                "cpu_seconds": round(cpu_clock() - cpu_start, 4),
+                "peak_rss_mb": peak_rss_mb(),
+                "background": background,
+            }
+            with self._lock:
+                self.stages.append(record)
+            if self.on_event:
+                self.on_event(dict(record, event="stage_finished"))
+
+    def set_audio_duration(self, seconds):
+        self.audio_seconds = seconds
+
+    def annotate(self, **info):
+        """Attach extra facts about the run (model, detected key, ...) to the report."""
+        self.info.update(info)
+
+    def report(self):
+        """Return the measurements as a dict ready for json.dump."""
+        total = time.perf_counter() - self.started
+        stages = [
+            dict(stage, real_time_factor=_rtf(stage["wall_seconds"], self.audio_seconds))
+            for stage in self.stages
+        ]
+        peaks = [stage["peak_rss_mb"] for stage in stages if stage["peak_rss_mb"] is not None]
+        return {
+            "name": self.name,
+            "audio_seconds": self.audio_seconds,
+            "wall_seconds": round(total, 4),
+            "real_time_factor": _rtf(total, self.audio_seconds),
+            "peak_rss_mb": max(peaks) if peaks else None,
+            "info": self.info,
+            "stages": stages,
+        }
+
+
+def aggregate_reports(reports, elapsed_seconds=None):
+    """Combine per-song reports into batch totals and per-stage sums.
+
+    elapsed_seconds is the batch's own wall time, which is shorter than the
+    sum of per-song times when songs run in parallel.
+    """
+    audio_seconds = sum(r["audio_seconds"] or 0 for r in reports)
+    wall_seconds = sum(r["wall_seconds"] for r in reports)
+    stages = {}
+    for report in reports:
+        for stage in report["stages"]:
+            totals = stages.setdefault(stage["stage"], {"count": 0, "wall_seconds": 0.0, "cpu_seconds": 0.0})
+            totals["count"] += 1
+            totals["wall_seconds"] += stage["wall_seconds"]
+            totals["cpu_seconds"] += stage["cpu_seconds"]
+    for totals in stages.values():
+        totals["wall_seconds"] = round(totals["wall_seconds"], 4)
+        totals["cpu_seconds"] = round(totals["cpu_seconds"], 4)
+        totals["real_time_factor"] = _rtf(totals["wall_seconds"], audio_seconds)
+    peaks = [r["peak_rss_mb"] for r in reports if r.get("peak_rss_mb") is not None]
+    return {
+        "songs": len(reports),
+        "audio_seconds": round(audio_seconds, 4),
+        "wall_seconds": round(wall_seconds, 4),
+        "real_time_factor": _rtf(wall_seconds, audio_seconds),
+        "peak_rss_mb": max(peaks) if peaks else None,
+        "elapsed_seconds": round(elapsed_seconds, 4) if elapsed_seconds else None,
+        "songs_per_hour": round(len(reports) * 3600 / elapsed_seconds, 2) if elapsed_seconds else None,
+        "stages": stages,
+    }
+
+
+def write_report(report, path):
+    """Write a report as pretty-printed JSON, creating folders as needed."""
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    with open(path, "w") as f:
+        json.dump(report, f, indent=2)
@@ -20,20 +20,13 @@ if "%~1"=="" (
   exit /b 1
 )
 
-REM Check if the file exists
-if not exist "%~1" (
-  echo X Error: File not found: %1
-  pause
-  exit /b 1
-)
-
-REM Check for necessary dependencies
-python -c "import librosa, yaml, demucs" > nul 2>&1
+REM Check for necessary dependencies, without paying for importing them
+python -c "import sys, stem_splitter; sys.exit(bool(stem_splitter.missing_modules()))" > nul 2>&1
 if %ERRORLEVEL% NEQ 0 (
   echo Warning: Missing dependencies. Running setup first...
   call setup.bat
 )
 
-REM Run the stem splitter
-python stem_splitter.py "%~1"
+REM Run the stem splitter, which checks the inputs and options itself
+python stem_splitter.py %*
 pause
\ No newline at end of file
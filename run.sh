@@ -16,28 +16,22 @@ if ! command -v python3 &> /dev/null; then
     exit 1
 fi
 
-if [ -z "$1" ]; then
+if [ $# -eq 0 ]; then
   echo "Please provide an audio file to process."
   echo "Example: ./run.sh ~/Music/my_song.mp3"
   exit 1
 fi
 
-# Check if the file exists
-if [ ! -f "$1" ]; then
-  echo "❌ Error: File not found: $1"
-  exit 1
-fi
-
 # Check for necessary dependencies
 if [ ! -f "requirements.txt" ]; then
   echo "⚠️ Warning: requirements.txt not found"
 else
-  # Check if dependencies are installed
-  if ! python3 -c "import librosa, yaml, demucs" &> /dev/null; then
+  # Check if dependencies are installed, without paying for importing them
+  if ! python3 -c "import sys, stem_splitter; sys.exit(bool(stem_splitter.missing_modules()))" &> /dev/null; then
     echo "⚠️ Missing dependencies. Running setup first..."
     bash setup.sh
   fi
 fi
 
-# Run the stem splitter
-python3 stem_splitter.py "$1"
\ No newline at end of file
+# Run the stem splitter, which checks the inputs and options itself
+python3 stem_splitter.py "$@"
\ No newline at end of file
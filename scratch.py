@@ -0,0 +1,162 @@
+#!/usr/bin/env python3
+"""Scratch folders for intermediates, on a RAM-backed filesystem when they fit.
+
+Each process gets its own run folder, marked with its host and pid. Folders
+go on tmpfs (e.g. /dev/shm) while their estimated sizes fit the RAM budget
+and spill to disk after that. Run folders are deleted when the process
+exits, and folders left behind by a process that crashed are collected the
+next time one starts.
+"""
+import atexit
+import json
+import os
+import re
+import shutil
+import socket
+import threading
+import time
+import uuid
+
+from separation_cache import dir_size
+
+OWNER_FILE = "owner.json"
+
+# Run folders without a readable owner file are only collected once they're this old
+UNOWNED_GRACE_SECONDS = 3600
+
+
+def default_ram_dir():
+    """/dev/shm if this machine has a writable one, else None."""
+    if os.path.isdir("/dev/shm") and os.access("/dev/shm", os.W_OK):
+        return "/dev/shm"
+    return None
+
+
+def pid_alive(pid):
+    """Whether a process with this pid is running on this machine."""
+    if os.name == "nt":
+        # os.kill() would terminate the process on Windows, so ask for a handle instead
+        import ctypes
+        handle = ctypes.windll.kernel32.OpenProcess(0x1000, False, pid)
+        if not handle:
+            return False
+        ctypes.windll.kernel32.CloseHandle(handle)
+        return True
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+def collect_orphans(roots):
+    """Delete run folders under roots whose process is gone; returns (folders, bytes) freed."""
+    host = socket.gethostname()
+    removed, freed = 0, 0
+    for root in roots:
+        try:
+            names = os.listdir(root)
+        except OSError:
+            continue
+        for name in names:
+            run_dir = os.path.join(root, name)
+            try:
+                with open(os.path.join(run_dir, OWNER_FILE)) as f:
+                    owner = json.load(f)
+                # Another machine sharing the folder may still be using its runs
+                orphaned = owner["host"] == host and not pid_alive(owner["pid"])
+            except (OSError, ValueError, KeyError):
+                try:
+                    orphaned = time.time() - os.path.getmtime(run_dir) > UNOWNED_GRACE_SECONDS
+                except OSError:
+                    continue
+            if orphaned:
+                size = dir_size(run_dir)
+                shutil.rmtree(run_dir, ignore_errors=True)
+                if not os.path.exists(run_dir):
+                    removed += 1
+                    freed += size
+    return removed, freed
+
+
+class ScratchSpace:
+    """This process's scratch folders, in RAM up to ram_budget_bytes and on disk beyond."""
+
+    def __init__(self, disk_root, ram_root=None, ram_budget_bytes=0):
+        run_id = f"{socket.gethostname()}-{os.getpid()}-{uuid.uuid4().hex[:8]}"
+        self.disk_dir = os.path.join(disk_root, run_id)
+        self.ram_dir = os.path.join(ram_root, run_id) if ram_root and ram_budget_bytes > 0 else None
+        self.ram_budget = ram_budget_bytes
+        self.ram_reserved = 0
+        self._folders = {}
+        self._count = 0
+        self._lock = threading.Lock()
+
+    def allocate(self, name, size_estimate):
+        """Create an empty folder for name, in RAM if size_estimate still fits in the budget."""
+        with self._lock:
+            in_ram = self.ram_dir is not None and self.ram_reserved + size_estimate <= self.ram_budget
+            if in_ram:
+                self.ram_reserved += size_estimate
+            self._count += 1
+            folder = f"{self._count}-" + re.sub(r"[^\w.-]+", "_", name)[:80]
+        if in_ram:
+            path = os.path.join(self.ram_dir, folder)
+            try:
+                self._start_run(self.ram_dir)
+                # The budget is ours, but other programs use tmpfs too
+                if shutil.disk_usage(self.ram_dir).free < size_estimate:
+                    raise OSError("not enough free space")
+                os.makedirs(path)
+                with self._lock:
+                    self._folders[path] = size_estimate
+                return path
+            except OSError:
+                # Spill to disk instead
+                with self._lock:
+                    self.ram_reserved -= size_estimate
+        path = os.path.join(self.disk_dir, folder)
+        self._start_run(self.disk_dir)
+        os.makedirs(path)
+        with self._lock:
+            self._folders[path] = 0
+        return path
+
+    def release(self, path):
+        """Delete a folder from allocate() and return its share of the RAM budget."""
+        shutil.rmtree(path, ignore_errors=True)
+        with self._lock:
+            self.ram_reserved -= self._folders.pop(path, 0)
+
+    def cleanup(self):
+        """Delete every folder of this run."""
+        for run_dir in (self.ram_dir, self.disk_dir):
+            if run_dir:
+                shutil.rmtree(run_dir, ignore_errors=True)
+        with self._lock:
+            self._folders.clear()
+            self.ram_reserved = 0
+
+    def _start_run(self, run_dir):
+        owner_file = os.path.join(run_dir, OWNER_FILE)
+        if os.path.exists(owner_file):
+            return
+        os.makedirs(run_dir, exist_ok=True)
+        with open(owner_file, 'w') as f:
+            json.dump({"host": socket.gethostname(), "pid": os.getpid(), "started": time.time()}, f)
+
+
+_scratch = None
+_scratch_lock = threading.Lock()
+
+
+def get_scratch(disk_root, ram_root=None, ram_budget_bytes=0):
+    """This process's ScratchSpace, created on first use and removed at exit."""
+    global _scratch
+    with _scratch_lock:
+        if _scratch is None:
+            _scratch = ScratchSpace(disk_root, ram_root, ram_budget_bytes)
+            atexit.register(_scratch.cleanup)
+        return _scratch
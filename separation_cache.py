@@ -0,0 +1,163 @@
+#!/usr/bin/env python3
+"""Persistent cache of separated stems, drum parts and key/BPM results.
+
+Entries are keyed on a hash of the decoded audio plus every model and
+inference setting that affects the result, so renaming a file or changing
+``filename_format``/``output_dir`` reuses the previous separation instead of
+running Demucs and drumsep again.
+
+Entries are hardlinks to the output files, so filling the cache never writes
+audio a second time; outputs on another device than the cache aren't cached.
+Because an output edited in place changes the entry too, every file's
+checksum is verified before an entry is served.
+"""
+import hashlib
+import json
+import os
+import shutil
+import time
+
+from finalize import partial_path
+
+META_FILE = "meta.json"
+
+
+def audio_hash(wav):
+    """Hash a decoded (channels, samples) tensor or array."""
+    data = wav.cpu().numpy() if hasattr(wav, "cpu") else wav
+    digest = hashlib.sha256()
+    digest.update(str(data.shape).encode())
+    digest.update(data.tobytes())
+    return digest.hexdigest()
+
+
+def file_checksum(path):
+    """SHA-256 of a file, read in chunks."""
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def cache_key(content_hash, settings):
+    """Combine the audio hash with the settings that produced the result."""
+    settings_json = json.dumps(settings, sort_keys=True)
+    return hashlib.sha256(f"{content_hash}:{settings_json}".encode()).hexdigest()[:32]
+
+
+def dir_size(path):
+    """Total size of the files under path, in bytes."""
+    total = 0
+    for root, _, files in os.walk(path):
+        for name in files:
+            try:
+                total += os.path.getsize(os.path.join(root, name))
+            except OSError:
+                pass
+    return total
+
+
+class SeparationCache:
+    """A directory of cache entries, evicted least-recently-used first."""
+
+    def __init__(self, cache_dir, max_size_gb=20):
+        self.cache_dir = cache_dir
+        self.max_bytes = int(float(max_size_gb) * 1024 ** 3)
+        os.makedirs(cache_dir, exist_ok=True)
+
+    def _entry_dir(self, key):
+        return os.path.join(self.cache_dir, key)
+
+    def get(self, key):
+        """Return {"meta": dict, "files": {name: path}} or None on a miss."""
+        entry_dir = self._entry_dir(key)
+        meta_file = os.path.join(entry_dir, META_FILE)
+        try:
+            with open(meta_file, 'r') as f:
+                meta = json.load(f)
+        except (OSError, ValueError):
+            return None
+
+        files = {name: os.path.join(entry_dir, name) for name in meta.get("files", [])}
+        checksums = meta.get("checksums", {})
+        for name, path in files.items():
+            try:
+                intact = file_checksum(path) == checksums[name]
+            except (OSError, KeyError):
+                intact = False
+            if not intact:
+                # Deleted, or an output linked to it was edited in place
+                print(f"⚠️ Cached {name} is missing or changed, discarding cache entry")
+                shutil.rmtree(entry_dir, ignore_errors=True)
+                return None
+
+        # Touch the entry so LRU eviction sees it as recently used
+        os.utime(meta_file)
+        return {"meta": meta, "files": files}
+
+    def put(self, key, files, meta):
+        """Hardlink {name: source_path} files and store a metadata dict under key.
+
+        Returns False without caching anything if a file can't be hardlinked
+        (another device, or a filesystem without hardlinks).
+        """
+        cache_device = os.stat(self.cache_dir).st_dev
+        if any(os.stat(source).st_dev != cache_device for source in files.values()):
+            return False
+
+        entry_dir = self._entry_dir(key)
+        staging_dir = f"{entry_dir}.tmp-{os.getpid()}"
+        shutil.rmtree(staging_dir, ignore_errors=True)
+
+        try:
+            checksums = {}
+            for name, source in files.items():
+                dest = os.path.join(staging_dir, name)
+                os.makedirs(os.path.dirname(dest), exist_ok=True)
+                tmp = partial_path(dest)
+                try:
+                    os.link(source, tmp)
+                except OSError:
+                    return False
+                os.replace(tmp, dest)
+                checksums[name] = file_checksum(dest)
+
+            meta = dict(meta, files=sorted(files), checksums=checksums, created=time.time())
+            with open(os.path.join(staging_dir, META_FILE), 'w') as f:
+                json.dump(meta, f, indent=2)
+
+            # Swap the finished entry into place so readers never see half of it
+            shutil.rmtree(entry_dir, ignore_errors=True)
+            os.replace(staging_dir, entry_dir)
+        finally:
+            shutil.rmtree(staging_dir, ignore_errors=True)
+
+        self.evict(keep=key)
+        return True
+
+    def evict(self, keep=None):
+        """Delete least-recently-used entries until the cache fits its budget."""
+        entries = []
+        total = 0
+        for name in os.listdir(self.cache_dir):
+            if ".tmp-" in name:
+                continue
+            entry_dir = self._entry_dir(name)
+            meta_file = os.path.join(entry_dir, META_FILE)
+            try:
+                last_used = os.path.getmtime(meta_file)
+            except OSError:
+                continue
+            size = dir_size(entry_dir)
+            entries.append((last_used, name, size))
+            total += size
+
+        for _, name, size in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            if name == keep:
+                continue
+            shutil.rmtree(self._entry_dir(name), ignore_errors=True)
+            total -= size
+            print(f"🧹 Evicted cache entry {name}")
@@ -10,15 +10,84 @@ import glob
 import yaml
 import argparse
 import platform  # NEW: For platform detection
+import importlib.util
+import copy
+import multiprocessing
+import queue
+import signal
+import sqlite3
+import threading
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, ThreadPoolExecutor, as_completed, wait
+from concurrent.futures.process import BrokenProcessPool
 
-# Try to import librosa, but provide helpful message if not installed
-try:
-    import librosa
-except ImportError:
-    print("Error: librosa is not installed.")
-    print("Please install it using: pip install librosa")
-    print("See requirements.txt for all dependencies.")
-    sys.exit(1)
+# librosa, numpy and torch are imported by the stages that use them, so
+# --help, --dry-run and config checks don't pay for loading them
+from demucs_engine import (ENGINE_OPTIONS, OUTPUT_FORMATS, AudioBuffer, SeparationError, configure_threads,
+                           get_engine, matches_output_format, output_extension)
+from checkpoint import RunManifest, run_key
+from finalize import Finalizer
+from job_queue import JobQueue
+from job_server import serve
+from library_index import LibraryIndex
+from profiler import RunProfiler, aggregate_reports, write_report
+from scratch import collect_orphans, default_ram_dir, get_scratch
+from separation_cache import SeparationCache, audio_hash, cache_key
+
+AUDIO_EXTENSIONS = (".mp3", ".wav", ".ogg", ".flac", ".m4a", ".aiff", ".aif")
+PLAYLIST_EXTENSIONS = (".m3u", ".m3u8", ".txt")
+
+DRUMSEP_MODEL_ID = "49469ca8"
+
+# Settings a performance profile leaves out: thread counts of 0 keep torch's defaults
+PERFORMANCE_DEFAULTS = {
+    "intra_op_threads": 0,
+    "inter_op_threads": 0,
+    "shifts": 1,
+    "overlap": 0.25,
+    "segment": None,
+    "inference_mode": True,
+    "quantize": False
+}
+
+# Bytes per sample of each output subtype, for sizing scratch folders
+SAMPLE_BYTES = {"PCM_16": 2, "PCM_24": 3, "FLOAT": 4}
+
+# Modules a real run needs; checked with find_spec, which doesn't import them
+# Times a batch song is started before a crashing worker counts as its failure
+BATCH_ATTEMPTS = 2
+
+REQUIRED_MODULES = ["librosa", "numpy", "soundfile", "torch", "demucs"]
+
+# Define stems available for each model
+MODEL_STEMS = {
+    "htdemucs": ["bass", "drums", "other", "vocals"],
+    "htdemucs_6s": ["bass", "drums", "other", "vocals", "piano", "guitar"],
+    "htdemucs_ft": ["bass", "drums", "other", "vocals"],
+    "mdx_extra": ["bass", "drums", "other", "vocals"],
+    "mdx_extra_q": ["bass", "drums", "other", "vocals"]
+}
+
+# Map drumsep's Spanish part names to English
+DRUM_PARTS = {
+    "bombo.wav": "Kick",
+    "platillos.wav": "Hats",
+    "redoblante.wav": "Snare-Clap",
+    "toms.wav": "Toms"
+}
+
+class PipelineError(Exception):
+    """Raised when a song can't be processed."""
+
+def merge_defaults(config, defaults):
+    """Fill in any settings missing from a user config with their defaults."""
+    for key, value in defaults.items():
+        if isinstance(value, dict):
+            if not isinstance(config.get(key), dict):
+                config[key] = {}
+            merge_defaults(config[key], value)
+        elif key not in config:
+            config[key] = value
+    return config
 
 def load_config(config_path=None):
     """Load configuration from YAML file or use defaults."""
@@ -40,7 +109,79 @@ def load_config(config_path=None):
         "output": {
             "organize_by_song": True,
             "include_key_bpm": True,
-            "filename_format": "{key} - {bpm}BPM - {name} - ({stem})"
+            "filename_format": "{key} - {bpm}BPM - {name} - ({stem})",
+            "keep_intermediates": False,
+            "format": "wav16",
+            "flac_compression": 5,
+            "writer_threads": 4,
+            "link_full_track": False
+        },
+        "analysis": {
+            "mode": "accurate"
+        },
+        "streaming": {
+            "mode": "auto",
+            "threshold_minutes": 20,
+            "segment_seconds": 60,
+            "overlap_seconds": 2
+        },
+        "batch": {
+            "workers": 1,
+            "threads_per_worker": 0
+        },
+        "performance": {
+            "profile": "balanced",
+            "profiles": {
+                "fast": {"inter_op_threads": 1, "overlap": 0.1, "quantize": True},
+                "balanced": {},
+                "quality": {"shifts": 2, "overlap": 0.5}
+            }
+        },
+        "pipeline": {
+            "enabled": True,
+            "decode_workers": 1,
+            "analysis_workers": 1,
+            "finalize_workers": 1,
+            "queue_size": 1,
+            "max_memory_mb": 0
+        },
+        "cache": {
+            "enabled": True,
+            "dir": "~/BestStemSplitterEver/cache",
+            "max_size_gb": 20,
+            "refresh": False
+        },
+        "silence": {
+            "enabled": True,
+            "threshold_db": -50,
+            "action": "skip"
+        },
+        "checkpoint": {
+            "enabled": False
+        },
+        "scratch": {
+            "ram_dir": "auto",
+            "ram_budget_mb": 2048
+        },
+        "library": {
+            "enabled": True,
+            "db": "~/BestStemSplitterEver/library.db",
+            "bpm_range": 3
+        },
+        "watch": {
+            "queue_db": "~/BestStemSplitterEver/jobs.db",
+            "poll_seconds": 2,
+            "settle_seconds": 5,
+            "max_attempts": 3,
+            "retry_delay_seconds": 30,
+            "priority_folders": {"priority": 10}
+        },
+        "server": {
+            "host": "127.0.0.1",
+            "port": 8765,
+            "queue_depth": 8,
+            "max_upload_mb": 500,
+            "keep_finished_jobs": 100
         }
     }
     
@@ -68,9 +209,23 @@ def load_config(config_path=None):
         except Exception as e:
             print(f"⚠️ Error creating default config: {e}")
     
+    # Older config files may not have every section yet
+    config = merge_defaults(config or {}, copy.deepcopy(default_config))
+    
     # Expand all paths with user home directory
     config["paths"]["temp_dir"] = os.path.expanduser(config["paths"]["temp_dir"])
     config["paths"]["output_dir"] = os.path.expanduser(config["paths"]["output_dir"])
+    config["cache"]["dir"] = os.path.expanduser(config["cache"]["dir"])
+    config["watch"]["queue_db"] = os.path.expanduser(config["watch"]["queue_db"])
+    config["library"]["db"] = os.path.expanduser(config["library"]["db"])
+    
+    if config["performance"]["profile"] not in config["performance"]["profiles"]:
+        print(f"⚠️ Unknown performance profile '{config['performance']['profile']}', using balanced")
+        config["performance"]["profile"] = "balanced"
+    
+    if config["output"]["format"] not in OUTPUT_FORMATS:
+        print(f"⚠️ Unknown output format '{config['output']['format']}', using wav16")
+        config["output"]["format"] = "wav16"
     
     # CHANGED: Only expand drumsep_dir if it's an absolute path
     if config["tools"]["drumsep_dir"].startswith("~"):
@@ -82,28 +237,115 @@ def load_config(config_path=None):
     
     return config
 
+def missing_modules(modules=REQUIRED_MODULES):
+    """Names of modules that aren't installed, found without importing anything."""
+    return [name for name in modules if importlib.util.find_spec(name) is None]
+
+def performance_profile(config):
+    """Settings of the active performance profile, with anything it leaves out at the default."""
+    profile = config["performance"]["profiles"][config["performance"]["profile"]]
+    return dict(PERFORMANCE_DEFAULTS, **(profile or {}))
+
+def configure_engine(engine, config):
+    """Apply the active performance profile to an engine and this process's inter-op threads."""
+    profile = performance_profile(config)
+    configure_threads(None, profile["inter_op_threads"])
+    return engine.configure(**{name: profile[name] for name in ENGINE_OPTIONS})
+
+def scratch_roots(config):
+    """(disk folder, RAM folder or None) that hold every process's scratch runs."""
+    ram_dir = config["scratch"]["ram_dir"]
+    if ram_dir == "auto":
+        ram_dir = default_ram_dir()
+    ram_root = os.path.join(os.path.expanduser(ram_dir), "stem_splitter-scratch") if ram_dir else None
+    return os.path.join(config["paths"]["temp_dir"], "scratch"), ram_root
+
+def song_scratch(config):
+    """This process's scratch space for intermediates that don't need to outlive it."""
+    disk_root, ram_root = scratch_roots(config)
+    return get_scratch(disk_root, ram_root, int(config["scratch"]["ram_budget_mb"] * 1024 * 1024))
+
+def collect_scratch_orphans(config):
+    """Delete scratch folders left behind by processes that crashed."""
+    removed, freed = collect_orphans([root for root in scratch_roots(config) if root])
+    if removed:
+        print(f"🧹 Removed {removed} orphaned scratch folder(s) ({freed / 1024 / 1024:.0f} MB)")
+
+def output_options(config):
+    """Keyword arguments for the engine's writers, from the output section of the config."""
+    return {
+        "output_format": config["output"]["format"],
+        "compression_level": config["output"]["flac_compression"],
+    }
+
 def get_song_name(file_path):
     """Extract just the filename without extension"""
     return os.path.splitext(os.path.basename(file_path))[0]
 
-def run_command(command, desc):
-    """Run a shell command and display its output"""
-    print(f"\n🔄 {desc}...\n")
-    print(f"Running: {command}")
-    result = subprocess.run(command, shell=True, capture_output=True, text=True)
+# Major and minor key profiles (Krumhansl-Kessler profiles)
+MAJOR_PROFILE = [6.35, 2.23, 3.48, 2.33, 4.38, 4.09, 2.52, 5.19, 2.39, 3.66, 2.29, 2.88]
+MINOR_PROFILE = [6.33, 2.68, 3.52, 5.38, 2.60, 3.53, 2.54, 4.75, 3.98, 2.69, 3.34, 3.17]
+
+KEY_NAMES = ['C', 'C#', 'D', 'D#', 'E', 'F', 'F#', 'G', 'G#', 'A', 'A#', 'B']
+
+CAMELOT_MAP = {
+    'C': '8B', 'G': '9B', 'D': '10B', 'A': '11B', 'E': '12B', 'B': '1B', 
+    'F#': '2B', 'C#': '3B', 'G#': '4B', 'D#': '5B', 'A#': '6B', 'F': '7B',
+    'Am': '8A', 'Em': '9A', 'Bm': '10A', 'F#m': '11A', 'C#m': '12A', 'G#m': '1A', 
+    'D#m': '2A', 'A#m': '3A', 'Fm': '4A', 'Cm': '5A', 'Gm': '6A', 'Dm': '7A'
+}
+
+# Row j is the profile rotated to tonic j: 12 major keys, then 12 minor keys
+KEY_PROFILES = (
+    [MAJOR_PROFILE[-j:] + MAJOR_PROFILE[:-j] for j in range(12)] +
+    [MINOR_PROFILE[-j:] + MINOR_PROFILE[:-j] for j in range(12)]
+)
+
+# Fast analysis settings: decimated rate, and how much of the track to look at
+FAST_SAMPLE_RATE = 11025
+FAST_CHROMA_WINDOWS = 8
+FAST_CHROMA_WINDOW_SECONDS = 15
+
+def estimate_key(chroma_avg):
+    """Match a 12-bin chroma average against all 24 keys in one matrix product.
+
+    Returns (key, camelot).
+    """
+    import numpy as np
     
-    if result.returncode != 0:
-        print(f"⚠️ Command failed with error code {result.returncode}")
-        print(f"Error output: {result.stderr}")
-        return False
-    return True
+    scores = np.asarray(KEY_PROFILES) @ np.asarray(chroma_avg, dtype=float)
+    max_major_idx = int(np.argmax(scores[:12]))
+    max_minor_idx = int(np.argmax(scores[12:]))
+    
+    if scores[max_major_idx] > scores[12 + max_minor_idx]:
+        key = KEY_NAMES[max_major_idx]
+    else:
+        key = f"{KEY_NAMES[max_minor_idx]}m"
+    
+    return key, CAMELOT_MAP.get(key, "")
 
-def detect_key_and_tempo(audio_file):
-    """Detect musical key and tempo using librosa"""
+def estimate_tempo(onset_env, sr, hop_length=512):
+    """Estimate a tempo in whole BPM from an onset strength envelope."""
+    import librosa
+    import numpy as np
+    
+    # librosa >= 0.10 moved tempo() to librosa.feature
+    tempo_fn = getattr(librosa.feature, "tempo", None) or librosa.beat.tempo
+    tempo = tempo_fn(onset_envelope=onset_env, sr=sr, hop_length=hop_length)
+    return round(float(np.asarray(tempo).ravel()[0]))
+
+def detect_key_and_tempo(audio_file, y=None, sr=None):
+    """Detect musical key and tempo using librosa
+
+    Pass already decoded mono audio as y/sr to skip loading the file again.
+    """
+    import librosa
+    
     print(f"Analyzing key and tempo for {os.path.basename(audio_file)}...")
     
     # Load the audio file
-    y, sr = librosa.load(audio_file)
+    if y is None:
+        y, sr = librosa.load(audio_file)
     
     # Detect tempo
     tempo, _ = librosa.beat.beat_track(y=y, sr=sr)
@@ -112,40 +354,238 @@ def detect_key_and_tempo(audio_file):
 
     # Analyze the key using chroma features
     chroma = librosa.feature.chroma_cqt(y=librosa.effects.harmonic(y), sr=sr)
-    chroma_avg = chroma.mean(axis=1)
+    key, camelot_key = estimate_key(chroma.mean(axis=1))
     
-    # Key detection using correlation with key profiles
-    # Major and minor key profiles (Krumhansl-Kessler profiles)
-    major_profile = [6.35, 2.23, 3.48, 2.33, 4.38, 4.09, 2.52, 5.19, 2.39, 3.66, 2.29, 2.88]
-    minor_profile = [6.33, 2.68, 3.52, 5.38, 2.60, 3.53, 2.54, 4.75, 3.98, 2.69, 3.34, 3.17]
+    return key, camelot_key, tempo
+
+def sample_windows(y, sr, count, seconds):
+    """Return up to count evenly spaced excerpts of y, or y itself if it's short."""
+    import numpy as np
     
-    key_names = ['C', 'C#', 'D', 'D#', 'E', 'F', 'F#', 'G', 'G#', 'A', 'A#', 'B']
+    window = int(seconds * sr)
+    if len(y) <= window * count:
+        return [y]
+    starts = np.linspace(0, len(y) - window, count).astype(int)
+    return [y[start:start + window] for start in starts]
+
+def detect_key_and_tempo_fast(audio_file, y=None, sr=None):
+    """Cheaper key/tempo estimate for long files.
+
+    Works on audio decimated to FAST_SAMPLE_RATE, takes chroma from a few
+    sampled windows without HPSS and tempo from the onset envelope alone.
+    """
+    import librosa
+    import numpy as np
     
-    # Calculate correlation for each key
-    major_corr = [sum(chroma_avg[i] * major_profile[(i - j) % 12] for i in range(12)) for j in range(12)]
-    minor_corr = [sum(chroma_avg[i] * minor_profile[(i - j) % 12] for i in range(12)) for j in range(12)]
+    print(f"Analyzing key and tempo (fast) for {os.path.basename(audio_file)}...")
     
-    # Find the key with the highest correlation
-    max_major_idx = major_corr.index(max(major_corr))
-    max_minor_idx = minor_corr.index(max(minor_corr))
+    if y is None:
+        y, sr = librosa.load(audio_file, sr=FAST_SAMPLE_RATE)
+    elif sr != FAST_SAMPLE_RATE:
+        y = librosa.resample(y, orig_sr=sr, target_sr=FAST_SAMPLE_RATE)
+        sr = FAST_SAMPLE_RATE
     
-    if max(major_corr) > max(minor_corr):
-        key = key_names[max_major_idx]
-    else:
-        key = f"{key_names[max_minor_idx]}m"
-    
-    # Get Camelot notation
-    camelot_map = {
-        'C': '8B', 'G': '9B', 'D': '10B', 'A': '11B', 'E': '12B', 'B': '1B', 
-        'F#': '2B', 'C#': '3B', 'G#': '4B', 'D#': '5B', 'A#': '6B', 'F': '7B',
-        'Am': '8A', 'Em': '9A', 'Bm': '10A', 'F#m': '11A', 'C#m': '12A', 'G#m': '1A', 
-        'D#m': '2A', 'A#m': '3A', 'Fm': '4A', 'Cm': '5A', 'Gm': '6A', 'Dm': '7A'
-    }
+    # Tempo from the onset envelope, skipping beat tracking
+    hop_length = 256
+    onset_env = librosa.onset.onset_strength(y=y, sr=sr, hop_length=hop_length)
+    tempo = estimate_tempo(onset_env, sr, hop_length=hop_length)
     
-    camelot_key = camelot_map.get(key, "")
+    # STFT chroma on a handful of windows instead of CQT on the whole track
+    windows = sample_windows(y, sr, FAST_CHROMA_WINDOWS, FAST_CHROMA_WINDOW_SECONDS)
+    chroma_sum = np.zeros(12)
+    for window in windows:
+        chroma_sum += librosa.feature.chroma_stft(y=window, sr=sr, n_fft=4096, hop_length=1024).mean(axis=1)
+    key, camelot_key = estimate_key(chroma_sum / len(windows))
     
     return key, camelot_key, tempo
 
+# Stems that carry the harmony; whichever of them the model produces are used for key detection
+HARMONIC_STEMS = ["bass", "other", "piano", "guitar"]
+
+def detect_key_and_tempo_from_stems(audio_file, stems, sr):
+    """Detect tempo on the drums stem and key on the harmonic stems.
+
+    stems maps stem names to mono arrays at sr. Demucs has already split
+    harmonic from percussive content, so there's no HPSS pass here.
+    """
+    import librosa
+    import numpy as np
+    
+    print(f"Analyzing key and tempo from stems for {os.path.basename(audio_file)}...")
+    
+    tempo, _ = librosa.beat.beat_track(y=stems["drums"], sr=sr)
+    tempo = round(float(tempo.item() if hasattr(tempo, 'item') else tempo))
+    
+    harmonic = [stems[name] for name in HARMONIC_STEMS if name in stems]
+    if not harmonic:
+        raise ValueError("no harmonic stems to detect the key from")
+    chroma = librosa.feature.chroma_cqt(y=np.sum(harmonic, axis=0), sr=sr)
+    key, camelot_key = estimate_key(chroma.mean(axis=1))
+    
+    return key, camelot_key, tempo
+
+def stems_for_analysis(stem_audio, samplerate, sr):
+    """Mono arrays at sr of the stems stem-aware analysis looks at."""
+    return {
+        name: AudioBuffer(stem_audio[name], samplerate).at(sr, 1)[0].numpy()
+        for name in ["drums"] + HARMONIC_STEMS if name in stem_audio
+    }
+
+def load_stems_for_analysis(stem_files, sr):
+    """Same as stems_for_analysis, but for stems that are already on disk."""
+    import librosa
+    
+    return {
+        name: librosa.load(stem_files[name], sr=sr)[0]
+        for name in ["drums"] + HARMONIC_STEMS if name in stem_files
+    }
+
+# Analysis modes that work on the mix, and the mono sample rate each mode wants
+ANALYZERS = {
+    "accurate": detect_key_and_tempo,
+    "fast": detect_key_and_tempo_fast
+}
+ANALYSIS_SAMPLE_RATES = {
+    "accurate": 22050,
+    "fast": FAST_SAMPLE_RATE,
+    "stems": 22050
+}
+
+def analyze_song(audio_file, y=None, sr=None, mode="accurate", stems=None):
+    """Detect key and tempo, falling back to defaults if analysis fails.
+
+    The "stems" mode needs the separated stems and runs after demucs.
+    """
+    try:
+        if mode == "stems":
+            key, camelot, tempo = detect_key_and_tempo_from_stems(audio_file, stems, sr)
+        else:
+            key, camelot, tempo = ANALYZERS[mode](audio_file, y=y, sr=sr)
+        print(f"Detected key: {key} ({camelot}), tempo: {tempo} BPM")
+        return key, camelot, tempo
+    except Exception as e:
+        print(f"⚠️ Error detecting key and tempo: {e}")
+        print("Using default values")
+        return "Unknown", "", 0
+
+class StreamingAnalyzer:
+    """Key/tempo analysis that sees a long track one block at a time.
+
+    Each block only contributes its onset envelope and summed chroma, so
+    memory stays small no matter how long the track is.
+    """
+
+    def __init__(self, mode, samplerate):
+        import numpy as np
+        
+        self.mode = mode
+        self.source_samplerate = samplerate
+        self.sr = ANALYSIS_SAMPLE_RATES[mode]
+        self.hop_length = 256 if mode == "fast" else 512
+        self.onset_envs = []
+        self.chroma_sum = np.zeros(12)
+        self.chroma_frames = 0
+        self.error = None
+
+    def _mono(self, wav):
+        return AudioBuffer(wav, self.source_samplerate).at(self.sr, 1)[0].numpy()
+
+    def add(self, mix, stems):
+        """Accumulate one block of the mix and its separated stems."""
+        import librosa
+        
+        if self.error:
+            return
+        try:
+            if self.mode == "stems":
+                rhythm = self._mono(stems["drums"])
+                harmonic = self._mono(sum(stems[name] for name in HARMONIC_STEMS if name in stems))
+            else:
+                rhythm = harmonic = self._mono(mix)
+            
+            self.onset_envs.append(
+                librosa.onset.onset_strength(y=rhythm, sr=self.sr, hop_length=self.hop_length)
+            )
+            
+            if self.mode == "fast":
+                chroma = librosa.feature.chroma_stft(y=harmonic, sr=self.sr, n_fft=4096, hop_length=1024)
+            elif self.mode == "accurate":
+                chroma = librosa.feature.chroma_cqt(y=librosa.effects.harmonic(harmonic), sr=self.sr)
+            else:
+                chroma = librosa.feature.chroma_cqt(y=harmonic, sr=self.sr)
+            self.chroma_sum += chroma.sum(axis=1)
+            self.chroma_frames += chroma.shape[1]
+        except Exception as e:
+            self.error = e
+
+    def result(self):
+        """Return (key, camelot, tempo) for everything added so far."""
+        import librosa
+        import numpy as np
+        
+        if self.error:
+            raise self.error
+        onset_env = np.concatenate(self.onset_envs)
+        if self.mode == "fast":
+            tempo = estimate_tempo(onset_env, self.sr, hop_length=self.hop_length)
+        else:
+            tempo, _ = librosa.beat.beat_track(onset_envelope=onset_env, sr=self.sr, hop_length=self.hop_length)
+            tempo = round(float(tempo.item() if hasattr(tempo, 'item') else tempo))
+        key, camelot_key = estimate_key(self.chroma_sum / max(self.chroma_frames, 1))
+        return key, camelot_key, tempo
+
+def keys_agree(key_a, key_b):
+    """Whether two Camelot codes are the same key or a neighbouring one."""
+    if not key_a or not key_b:
+        return False
+    num_a, mode_a = int(key_a[:-1]), key_a[-1]
+    num_b, mode_b = int(key_b[:-1]), key_b[-1]
+    if mode_a == mode_b:
+        return (num_a - num_b) % 12 in (0, 1, 11)
+    return num_a == num_b
+
+def compare_analysis_modes(input_files, bpm_tolerance=2):
+    """Run fast and accurate analysis on the same files and report agreement.
+
+    Tempo counts as agreeing if it matches within bpm_tolerance, or at
+    half/double time. Returns a list of per-file result dicts.
+    """
+    import librosa
+    
+    results = []
+    for input_file in input_files:
+        y, sr = librosa.load(input_file)
+        row = {"file": input_file}
+        for mode in ANALYZERS:
+            start = time.perf_counter()
+            row[mode] = ANALYZERS[mode](input_file, y=y, sr=sr)
+            row[f"{mode}_seconds"] = time.perf_counter() - start
+        
+        fast_bpm, accurate_bpm = row["fast"][2], row["accurate"][2]
+        row["same_key"] = row["fast"][0] == row["accurate"][0]
+        row["related_key"] = keys_agree(row["fast"][1], row["accurate"][1])
+        row["bpm_agrees"] = any(
+            abs(fast_bpm * factor - accurate_bpm) <= bpm_tolerance for factor in (0.5, 1, 2)
+        )
+        results.append(row)
+    
+    print("\n📋 Analysis agreement (fast vs accurate)")
+    for row in results:
+        key_status = "✅" if row["same_key"] else ("🟡" if row["related_key"] else "❌")
+        bpm_status = "✅" if row["bpm_agrees"] else "❌"
+        print(f"{os.path.basename(row['file'])}: "
+              f"key {key_status} {row['fast'][0]} / {row['accurate'][0]}, "
+              f"bpm {bpm_status} {row['fast'][2]} / {row['accurate'][2]}, "
+              f"time {row['fast_seconds']:.1f}s / {row['accurate_seconds']:.1f}s")
+    
+    if results:
+        count = len(results)
+        same_key = sum(row["same_key"] for row in results)
+        bpm_agrees = sum(row["bpm_agrees"] for row in results)
+        speedup = sum(r["accurate_seconds"] for r in results) / max(sum(r["fast_seconds"] for r in results), 1e-9)
+        print(f"Key: {same_key}/{count} identical, BPM: {bpm_agrees}/{count} agree, fast mode {speedup:.1f}x faster")
+    return results
+
 def format_filename(template, data):
     """Format a filename according to the template."""
     return template.format(**data)
@@ -164,104 +604,870 @@ def open_folder(folder_path):
     except Exception as e:
         print(f"⚠️ Could not open folder: {e}")
 
-def run_drumsep(drums_file, output_dir, drumsep_dir):
-    """Run drumsep using the Python module instead of bash script."""
-    try:
+_drumsep_modules = {}
+
+def load_drumsep_module(drumsep_dir):
+    """Import drumsep.py from the configured drumsep directory (once)."""
+    if drumsep_dir not in _drumsep_modules:
         drumsep_py = os.path.join(drumsep_dir, "drumsep.py")
-        
-        # If the Python script exists, use it
-        if os.path.exists(drumsep_py):
-            print(f"Running drumsep.py on {os.path.basename(drums_file)}...")
-            
-            # Store original sys.path to restore it later
-            original_sys_path = sys.path.copy()
-            
-            # Add drumsep directory to path temporarily
-            sys.path.insert(0, drumsep_dir)
-            
-            try:
-                from drumsep import drumsep
-                result = drumsep.separate_drums(drums_file, output_dir)
-                
-                # Restore original sys.path
-                sys.path = original_sys_path
-                return result
-            except ImportError:
-                print("⚠️ Could not import drumsep module, falling back to script")
-                sys.path = original_sys_path
-                # Fall back to script approach
-        
-        # Fall back to bash script if Python version not found or failed
-        drumsep_script = os.path.join(drumsep_dir, "drumsep")
-        if not os.path.exists(drumsep_script):
-            print(f"⚠️ Drumsep script not found at {drumsep_script}")
-            return False
-            
-        # Use platform-specific approach
-        if platform.system() == "Windows":
-            # For Windows: Use Python to call the script
-            drumsep_cmd = f'python "{drumsep_py}" "{drums_file}" "{output_dir}"'
-        else:
-            # For Unix-like systems: Use bash
-            drumsep_cmd = f'cd "{drumsep_dir}" && bash drumsep "{drums_file}" "{output_dir}"'
-            
-        return run_command(drumsep_cmd, "Splitting drum stems")
+        spec = importlib.util.spec_from_file_location("drumsep_module", drumsep_py)
+        module = importlib.util.module_from_spec(spec)
+        spec.loader.exec_module(module)
+        _drumsep_modules[drumsep_dir] = module
+    return _drumsep_modules[drumsep_dir]
+
+def run_drumsep(drums, samplerate, drumsep_dir):
+    """Split an in-memory drums stem into {part file name: tensor}.
+
+    Returns an empty dict if drum separation fails.
+    """
+    drumsep_py = os.path.join(drumsep_dir, "drumsep.py")
+    if not os.path.exists(drumsep_py):
+        print(f"⚠️ drumsep.py not found at {drumsep_py}")
+        return {}
+
+    print(f"\n🔄 Splitting drum stems...\n")
+    try:
+        drumsep = load_drumsep_module(drumsep_dir)
+        parts = drumsep.separate_drums_tensor(drums, samplerate)
+        return {f"{name}.wav": part for name, part in parts.items()}
+    except SeparationError as e:
+        print(f"⚠️ Drum separation failed: {e}")
+        return {}
     except Exception as e:
         print(f"⚠️ Error running drumsep: {e}")
+        return {}
+
+def level_db(wav, samplerate, window_seconds=1.0):
+    """Loudest short-window RMS level of a (channels, samples) tensor, in dBFS."""
+    import numpy as np
+    
+    data = wav.cpu().numpy() if hasattr(wav, "cpu") else np.asarray(wav)
+    power = (data.astype(np.float64) ** 2).mean(axis=0)
+    if power.size == 0:
+        return -np.inf
+    # Mean power of each window; the last window may be shorter
+    starts = np.arange(0, power.size, max(1, int(window_seconds * samplerate)))
+    window_power = np.add.reduceat(power, starts) / np.diff(np.append(starts, power.size))
+    return 10 * np.log10(max(window_power.max(), 1e-20))
+
+def file_level_db(audio_file, window_seconds=1.0):
+    """Same as level_db for a WAV on disk, read one window at a time."""
+    import numpy as np
+    import soundfile as sf
+    
+    loudest = 1e-20
+    window = max(1, int(window_seconds * sf.info(audio_file).samplerate))
+    for block in sf.blocks(audio_file, blocksize=window, always_2d=True, dtype="float64"):
+        if block.size:
+            loudest = max(loudest, (block ** 2).mean())
+    return 10 * np.log10(loudest)
+
+def find_silent(sources, samplerate, config):
+    """Names of sources (tensors or WAV paths) that never rise above the silence threshold.
+    
+    A stem counts as silent only if every one-second window is below
+    silence.threshold_db, so a part that only plays in the intro is kept.
+    """
+    if not config["silence"]["enabled"]:
+        return set()
+    threshold = config["silence"]["threshold_db"]
+    silent = set()
+    for name, source in sources.items():
+        level = file_level_db(source) if isinstance(source, str) else level_db(source, samplerate)
+        if level < threshold:
+            silent.add(name)
+    if silent:
+        print(f"🔇 Silent (below {threshold} dBFS): {', '.join(sorted(silent))}")
+    return silent
+
+# Resolution of the level scan that picks the preview excerpt
+PREVIEW_HOP_SECONDS = 0.05
+
+def frame_levels(wav, samplerate, hop_seconds=PREVIEW_HOP_SECONDS):
+    """RMS level of the mono mix of a (channels, samples) tensor, one value per hop."""
+    import numpy as np
+    
+    data = wav.cpu().numpy() if hasattr(wav, "cpu") else np.asarray(wav)
+    mono = data.astype(np.float64).mean(axis=0)
+    hop = max(1, int(hop_seconds * samplerate))
+    frames = mono.size // hop
+    return np.sqrt((mono[:frames * hop].reshape(frames, hop) ** 2).mean(axis=1))
+
+def pick_excerpt(levels, seconds, hop_seconds=PREVIEW_HOP_SECONDS):
+    """Start time of the seconds-long window with the most energy and onsets.
+
+    Rises in level mark onsets (drum hits, entries), so a busy chorus wins
+    over a loud but static pad.
+    """
+    import numpy as np
+    
+    frames = max(1, int(round(seconds / hop_seconds)))
+    if len(levels) <= frames:
+        return 0.0
+    flux = np.maximum(np.diff(levels, prepend=levels[0]), 0)
+    score = levels / max(levels.max(), 1e-9) + flux / max(flux.max(), 1e-9)
+    window_scores = np.convolve(score, np.ones(frames), mode="valid")
+    return int(np.argmax(window_scores)) * hop_seconds
+
+def should_stream(input_file, engine, config):
+    """Whether a file is long enough to need bounded-memory streaming."""
+    mode = config["streaming"]["mode"]
+    if mode in ("always", True):
+        return True
+    if mode in ("never", False):
         return False
+    duration = engine.duration(input_file)
+    return duration is not None and duration > config["streaming"]["threshold_minutes"] * 60
 
-def main():
-    # Parse command line arguments
-    parser = argparse.ArgumentParser(description="Split audio into stems with key and BPM detection")
-    parser.add_argument("input_file", help="Audio file to process")
-    parser.add_argument("-c", "--config", help="Path to config file")
-    parser.add_argument("-o", "--output", help="Override output directory")
-    parser.add_argument("-m", "--model", help="Override demucs model (e.g., htdemucs, htdemucs_6s, mdx_extra)")
-    args = parser.parse_args()
+def separate_streaming(input_file, engine, config, demucs_song_dir, drumsep_song_dir, use_drumsep,
+                       profiler, manifest=None):
+    """Analysis, demucs and drumsep for very long inputs, one segment at a time.
+
+    Stems are appended to WAVs in temp_dir as they're separated, so peak
+    memory depends on the segment length and not on the track length.
+    With a manifest, finished stages are checkpointed and skipped on resume.
+    Returns ((key, camelot, tempo), stem_files, drum_part_files, silent).
+    """
+    segment_seconds = config["streaming"]["segment_seconds"]
+    overlap_seconds = config["streaming"]["overlap_seconds"]
+    analysis_mode = config["analysis"]["mode"]
     
-    # Load configuration
-    config = load_config(args.config)
+    # Streamed analysis runs alongside separation, so both are resumed together
+    separation_record = manifest.completed("separation") if manifest else None
+    analysis_record = manifest.completed("analysis") if manifest else None
+    if separation_record and analysis_record and analysis_record["mode"] == analysis_mode:
+        print(f"⏩ Resuming after separation, reusing checkpointed stems")
+        stem_files = separation_record["artifacts"]
+        silent = set(separation_record["silent"])
+        key, camelot, tempo = analysis_record["key"], analysis_record["camelot"], analysis_record["bpm"]
+    else:
+        stems_dir = manifest.stage_dir("separation") if manifest else demucs_song_dir
+        analyzer = StreamingAnalyzer(analysis_mode, engine.samplerate)
+        pending = None
+        
+        with ThreadPoolExecutor(max_workers=1) as analysis_pool:
+            def analyze_block(mix, stems):
+                nonlocal pending
+                # Keep at most one block waiting for analysis so memory stays bounded
+                if pending:
+                    pending.result()
+                pending = analysis_pool.submit(analyzer.add, mix, stems)
+            
+            print(f"\n🔄 Splitting stems with demucs ({segment_seconds}s segments)...\n")
+            # Decoding and block-wise analysis happen inside this stage too
+            with profiler.stage("separation"):
+                try:
+                    stem_files = engine.separate_file_streaming(
+                        input_file, stems_dir, segment_seconds, overlap_seconds, on_block=analyze_block,
+                        **output_options(config)
+                    )
+                except SeparationError as e:
+                    raise PipelineError(f"Demucs failed: {e}") from e
+                if pending:
+                    pending.result()
+        
+        try:
+            with profiler.stage("analysis"):
+                key, camelot, tempo = analyzer.result()
+            print(f"Detected key: {key} ({camelot}), tempo: {tempo} BPM")
+        except Exception as e:
+            print(f"⚠️ Error detecting key and tempo: {e}")
+            print("Using default values")
+            key, camelot, tempo = "Unknown", "", 0
+        
+        silent = find_silent(stem_files, engine.samplerate, config)
+        if manifest:
+            manifest.complete("separation", stem_files, silent=sorted(silent))
+            manifest.complete("analysis", mode=analysis_mode, key=key, camelot=camelot, bpm=tempo)
     
-    # Override output directory if specified
-    if args.output:
-        config["paths"]["output_dir"] = os.path.abspath(args.output)
+    drum_part_files = {}
+    drumsep_record = manifest.completed("drumsep") if manifest else None
+    if drumsep_record:
+        print(f"⏩ Reusing checkpointed drum parts")
+        drum_part_files = drumsep_record["artifacts"]
+        silent |= set(drumsep_record["silent"])
+    elif use_drumsep and "drums" in silent:
+        print("🔇 Drums stem is silent, skipping drum separation")
+    elif use_drumsep and "drums" in stem_files:
+        print(f"\n🔄 Splitting drum stems ({segment_seconds}s segments)...\n")
+        try:
+            drumsep = load_drumsep_module(config["tools"]["drumsep_dir"])
+            parts_dir = manifest.stage_dir("drumsep") if manifest else drumsep_song_dir
+            with profiler.stage("drumsep"):
+                parts = drumsep.separate_drums_streaming(
+                    stem_files["drums"], parts_dir, segment_seconds, overlap_seconds, **output_options(config)
+                )
+            drum_part_files = {f"{name}.wav": path for name, path in parts.items()}
+            print("✅ Drum separation completed successfully")
+            drum_silent = find_silent(drum_part_files, engine.samplerate, config)
+            silent |= drum_silent
+            if manifest:
+                manifest.complete("drumsep", drum_part_files, silent=sorted(drum_silent))
+        except Exception as e:
+            print(f"⚠️ Drum separation failed: {e}")
+    
+    return (key, camelot, tempo), stem_files, drum_part_files, silent
+
+def get_cache(config):
+    """Return the separation cache, or None if caching is disabled."""
+    if not config["cache"]["enabled"]:
+        return None
+    return SeparationCache(config["cache"]["dir"], config["cache"]["max_size_gb"])
+
+class SongRun:
+    """One song moving through the pipeline: prepare, separate, finish.
+
+    prepare() decodes the input, looks it up in the cache and starts key/BPM
+    analysis; separate() runs demucs and drumsep; finish() names and writes
+    the output files. split_song() runs the three back to back, while
+    run_pipelined() overlaps them across consecutive songs.
+    """
+    
+    def __init__(self, input_file, config, profiler=None):
+        # Check that drumsep exists
+        drumsep_py = os.path.join(config["tools"]["drumsep_dir"], "drumsep.py")
         
-    # Override demucs model if specified
-    if args.model:
-        config["tools"]["demucs_model"] = args.model
-        print(f"Overriding demucs model to: {args.model}")
+        if not os.path.exists(drumsep_py):
+            print(f"⚠️ Drumsep script not found at {drumsep_py}")
+            print("Drum separation will be skipped.")
+            self.use_drumsep = False
+        else:
+            self.use_drumsep = True
+        
+        # Get input file and song name
+        self.input_file = os.path.abspath(input_file)
+        if not os.path.exists(self.input_file):
+            raise PipelineError(f"Input file {self.input_file} not found.")
+        
+        self.config = config
+        self.song_name = get_song_name(self.input_file)
+        self.keep_intermediates = config["output"]["keep_intermediates"]
+        self.analysis_mode = config["analysis"]["mode"]
+        self.profiler = profiler or RunProfiler(self.song_name, enabled=False)
+        
+        # Get the demucs model from config
+        self.demucs_model = config["tools"].get("demucs_model", "htdemucs_6s")
+        print(f"Using demucs model: {self.demucs_model}")
+        self.engine = configure_engine(get_engine(self.demucs_model), config)
+        drum_engine = None
+        if self.use_drumsep:
+            drum_engine = configure_engine(load_drumsep_module(config["tools"]["drumsep_dir"]).get_drum_engine(),
+                                           config)
+        
+        # Everything besides the audio itself that affects the stems on disk
+        self.settings = {
+            "demucs": self.engine.settings,
+            "drumsep": drum_engine.settings if drum_engine else None,
+            # Skipped silent stems aren't stored, so the gate is part of the key
+            "silence": config["silence"] if config["silence"]["enabled"] else None,
+            # Cached and checkpointed files are linked into the output as they are
+            "output_format": config["output"]["format"]
+        }
+        
+        self.output_dir = None
+        self.streaming = False
+        self.audio = None
+        self.cache = None
+        self.cache_id = None
+        self.cache_entry = None
+        self.manifest = None
+        self.analysis = None
+        self.analysis_result = None
+        # Results for this song, either in memory ({name: tensor}) or files on disk ({name: path})
+        self.stem_audio = {}
+        self.drum_part_audio = {}
+        self.stem_files = {}
+        self.drum_part_files = {}
+        # Stems and drum parts (e.g. "piano", "toms.wav") below the silence threshold
+        self.silent = set()
+        self.demucs_song_dir = os.path.join(config["paths"]["temp_dir"], self.demucs_model, self.song_name)
+        self.drumsep_song_dir = os.path.join(config["paths"]["temp_dir"], DRUMSEP_MODEL_ID, self.song_name)
+        # Streamed intermediates go to scratch folders (in RAM if they fit) unless they're kept
+        self.scratch_dirs = []
     
-    # Ensure directories exist
-    os.makedirs(config["paths"]["temp_dir"], exist_ok=True)
-    os.makedirs(config["paths"]["output_dir"], exist_ok=True)
+    @property
+    def _extension(self):
+        return output_extension(self.config["output"]["format"])
     
-    # Check that drumsep exists
-    drumsep_py = os.path.join(config["tools"]["drumsep_dir"], "drumsep.py")
-    drumsep_script = os.path.join(config["tools"]["drumsep_dir"], "drumsep")
+    def _save_checkpoint(self, wav, path):
+        # Same encoding as the final output, so finishing only has to link the file
+        self.engine.save_audio(wav, path, **output_options(self.config))
     
-    if not (os.path.exists(drumsep_py) or os.path.exists(drumsep_script)):
-        print(f"⚠️ Drumsep script not found at {drumsep_py} or {drumsep_script}")
-        print("Drum separation will be skipped.")
-        use_drumsep = False
-    else:
-        use_drumsep = True
+    def _analyze(self, *args, **kwargs):
+        with self.profiler.stage("analysis", background=True):
+            result = analyze_song(*args, **kwargs)
+        # Checkpoint key/BPM as soon as they're known, so a crash during drumsep doesn't redo them
+        if self.manifest and not self.cache_entry:
+            key, camelot, tempo = result
+            self.manifest.complete("analysis", mode=self.analysis_mode, key=key, camelot=camelot, bpm=tempo)
+        return result
     
-    # Get input file and song name
-    input_file = os.path.abspath(args.input_file)
-    if not os.path.exists(input_file):
-        print(f"Error: Input file {input_file} not found.")
-        sys.exit(1)
+    def memory_estimate(self):
+        """Rough peak bytes this song holds between decode and finalization."""
+        duration = self.engine.duration(self.input_file) or 0
+        if should_stream(self.input_file, self.engine, self.config):
+            duration = min(duration, self.config["streaming"]["segment_seconds"])
+        # The decoded mix, every stem and the four drum parts, as float32
+        buffers = 1 + len(self.engine.sources) + len(DRUM_PARTS)
+        return int(duration * self.engine.samplerate * self.engine.audio_channels * 4 * buffers)
     
-    song_name = get_song_name(input_file)
+    def preview(self, seconds):
+        """Separate only the liveliest seconds of the song into stems and drum parts.
+
+        Reuses the decoded audio when prepare() already ran, so a full run
+        afterwards doesn't decode again. Returns the folder the preview is in.
+        """
+        import numpy as np
+        
+        config = self.config
+        profiler = self.profiler
+        engine = self.engine
+        
+        with profiler.stage("model_load"):
+            try:
+                engine.load()
+            except SeparationError as e:
+                raise PipelineError(str(e)) from e
+        samplerate = engine.samplerate
+        length = int(seconds * samplerate)
+        
+        with profiler.stage("preview_scan"):
+            try:
+                if self.audio is None and not should_stream(self.input_file, engine, config):
+                    self.audio = AudioBuffer(engine.read_audio(self.input_file), samplerate)
+                if self.audio is not None:
+                    start = int(pick_excerpt(frame_levels(self.audio.wav, samplerate), seconds) * samplerate)
+                    excerpt = self.audio.wav[..., start:start + length]
+                else:
+                    # Too long to decode whole: scan it one segment at a time, then read just the excerpt
+                    segment = int(config["streaming"]["segment_seconds"] * samplerate)
+                    levels = []
+                    block_start = 0
+                    while True:
+                        block = engine.read_segment(self.input_file, block_start, segment)
+                        if block.shape[-1] == 0:
+                            break
+                        levels.append(frame_levels(block, samplerate))
+                        block_start += segment
+                    if not levels:
+                        raise PipelineError(f"No audio in {self.input_file}")
+                    start = int(pick_excerpt(np.concatenate(levels), seconds) * samplerate)
+                    excerpt = engine.read_segment(self.input_file, start, length)
+            except SeparationError as e:
+                raise PipelineError(str(e)) from e
+        print(f"🎧 Previewing {excerpt.shape[-1] / samplerate:.1f}s from {start / samplerate:.1f}s")
+        profiler.annotate(preview_start=start / samplerate, preview_seconds=excerpt.shape[-1] / samplerate)
+        
+        with profiler.stage("preview_separation"):
+            try:
+                stems = engine.separate_tensor(excerpt)
+            except SeparationError as e:
+                raise PipelineError(f"Demucs failed: {e}") from e
+        silent = find_silent(stems, samplerate, config)
+        drum_parts = {}
+        if self.use_drumsep and "drums" in stems and "drums" not in silent:
+            with profiler.stage("preview_drumsep"):
+                drum_parts = run_drumsep(stems["drums"], samplerate, config["tools"]["drumsep_dir"])
+            silent |= find_silent(drum_parts, samplerate, config)
+        
+        # Plain names: key and BPM aren't known yet, and previews are replaced on the next run
+        preview_dir = os.path.join(config["paths"]["output_dir"], "Previews", self.song_name)
+        outputs = {"Mix": excerpt}
+        for name, source in list(stems.items()) + list(drum_parts.items()):
+            label = DRUM_PARTS.get(name, name.title())
+            if name in silent:
+                if config["silence"]["action"] == "skip":
+                    continue
+                label = f"Silent {label}"
+            outputs[label] = source
+        
+        shutil.rmtree(preview_dir, ignore_errors=True)
+        os.makedirs(preview_dir, exist_ok=True)
+        ext = self._extension
+        opts = output_options(config)
+        finalizer = Finalizer()
+        with profiler.stage("preview_write"):
+            with ThreadPoolExecutor(max_workers=max(1, config["output"]["writer_threads"])) as writers:
+                futures = [
+                    writers.submit(finalizer.write, os.path.join(preview_dir, f"{label}{ext}"),
+                                   lambda tmp, source=source: engine.save_audio(source, tmp, clip="clamp", **opts))
+                    for label, source in outputs.items()
+                ]
+                for future in futures:
+                    future.result()
+        print(f"✅ Preview ready in: {preview_dir}")
+        return preview_dir
+    
+    def _use_scratch(self):
+        """Move this song's streamed intermediates into scratch folders sized for them."""
+        scratch = song_scratch(self.config)
+        duration = self.engine.duration(self.input_file) or 0
+        subtype = OUTPUT_FORMATS[self.config["output"]["format"]][2]
+        bytes_per_second = self.engine.samplerate * self.engine.audio_channels * SAMPLE_BYTES.get(subtype, 4)
+        self.demucs_song_dir = scratch.allocate(
+            f"{self.demucs_model}-{self.song_name}", int(duration * bytes_per_second * len(self.engine.sources))
+        )
+        self.scratch_dirs.append(self.demucs_song_dir)
+        if self.use_drumsep:
+            self.drumsep_song_dir = scratch.allocate(
+                f"{DRUMSEP_MODEL_ID}-{self.song_name}", int(duration * bytes_per_second * len(DRUM_PARTS))
+            )
+            self.scratch_dirs.append(self.drumsep_song_dir)
+    
+    def release_scratch(self):
+        """Delete this song's scratch folders; safe to call more than once."""
+        if not self.scratch_dirs:
+            return
+        scratch = song_scratch(self.config)
+        for path in self.scratch_dirs:
+            scratch.release(path)
+        self.scratch_dirs = []
+    
+    def prepare(self, analysis_pool):
+        """Decode, check the cache and checkpoints, and start analysis on analysis_pool.
+
+        Returns False if a checkpoint shows the song was already finished.
+        """
+        config = self.config
+        profiler = self.profiler
+        engine = self.engine
+        input_file = self.input_file
+        analysis_mode = self.analysis_mode
+        
+        # Pick up an interrupted run of this song at its first unfinished stage
+        if config["checkpoint"]["enabled"]:
+            self.manifest = RunManifest(
+                os.path.join(config["paths"]["temp_dir"], "runs", run_key(input_file, self.settings)), input_file
+            )
+            finalization_record = self.manifest.completed("finalization")
+            if finalization_record:
+                # Only the cleanup after placing the files was interrupted
+                self.output_dir = finalization_record["output_dir"]
+                print(f"⏩ Already finished, stems are in: {self.output_dir}")
+                self.manifest.clear()
+                return False
+        
+        with profiler.stage("model_load"):
+            try:
+                engine.load()
+            except SeparationError as e:
+                raise PipelineError(str(e)) from e
+        self.streaming = should_stream(input_file, engine, config)
+        
+        if self.streaming:
+            # Too long to hold in memory; the cache needs the whole decode to hash, so skip it
+            print(f"📼 Long input, separating in segments to bound memory use")
+            profiler.set_audio_duration(engine.duration(input_file))
+            return True
+        
+        # Decode the input once; the decoded audio is also what the cache is keyed on
+        with profiler.stage("decode"):
+            try:
+                self.audio = AudioBuffer(engine.read_audio(input_file), engine.samplerate)
+            except SeparationError as e:
+                raise PipelineError(str(e)) from e
+        profiler.set_audio_duration(self.audio.duration)
+        self.cache = get_cache(config)
+        
+        if self.cache:
+            with profiler.stage("cache_lookup"):
+                self.cache_id = cache_key(audio_hash(self.audio.wav), self.settings)
+                if not config["cache"]["refresh"]:
+                    self.cache_entry = self.cache.get(self.cache_id)
+        
+        analysis_sr = ANALYSIS_SAMPLE_RATES[analysis_mode]
+        if self.cache_entry:
+            print(f"✅ Found cached separation, skipping demucs and drumsep")
+            meta = self.cache_entry["meta"]
+            self.analysis_result = meta["key"], meta["camelot"], meta["bpm"]
+            self.silent = set(meta.get("silent", []))
+            for name, path in self.cache_entry["files"].items():
+                folder, filename = name.split("/", 1)
+                if folder == "stems":
+                    self.stem_files[os.path.splitext(filename)[0]] = path
+                else:
+                    # Drum parts are known by drumsep's file names, e.g. "bombo.wav"
+                    self.drum_part_files[os.path.splitext(filename)[0] + ".wav"] = path
+            if meta.get("analysis_mode", "accurate") != analysis_mode:
+                # Cached key/BPM came from another analysis mode, so redo just that
+                self.analysis_result = None
+                if analysis_mode == "stems":
+                    self.analysis = analysis_pool.submit(
+                        self._analyze, input_file, sr=analysis_sr, mode="stems",
+                        stems=load_stems_for_analysis(self.stem_files, analysis_sr)
+                    )
+                else:
+                    self.analysis = analysis_pool.submit(
+                        self._analyze, input_file, self.audio.at(analysis_sr, 1)[0].numpy(),
+                        analysis_sr, analysis_mode
+                    )
+            return True
+        
+        analysis_record = self.manifest.completed("analysis") if self.manifest else None
+        if analysis_record and analysis_record["mode"] == analysis_mode:
+            print(f"⏩ Reusing checkpointed key/BPM")
+            self.analysis_result = analysis_record["key"], analysis_record["camelot"], analysis_record["bpm"]
+        elif analysis_mode != "stems":
+            # Key/BPM are only needed for naming, so analysis runs in the background
+            # while demucs and drumsep work, on the same decoded audio resampled
+            # to the rate it needs
+            self.analysis = analysis_pool.submit(
+                self._analyze, input_file, self.audio.at(analysis_sr, 1)[0].numpy(), analysis_sr, analysis_mode
+            )
+        return True
     
-    # Detect key and tempo
+    def separate(self, analysis_pool):
+        """Run demucs and drumsep (unless cached or checkpointed)."""
+        if self.cache_entry:
+            return
+        if self.streaming:
+            if not (self.keep_intermediates or self.manifest or self.scratch_dirs):
+                self._use_scratch()
+            self.analysis_result, self.stem_files, self.drum_part_files, self.silent = separate_streaming(
+                self.input_file, self.engine, self.config, self.demucs_song_dir, self.drumsep_song_dir,
+                self.use_drumsep, self.profiler, self.manifest
+            )
+            return
+        
+        config = self.config
+        profiler = self.profiler
+        engine = self.engine
+        manifest = self.manifest
+        keep_intermediates = self.keep_intermediates
+        analysis_sr = ANALYSIS_SAMPLE_RATES[self.analysis_mode]
+        stem_audio = {}
+        
+        separation_record = manifest.completed("separation") if manifest else None
+        if separation_record:
+            print(f"⏩ Resuming after separation, reusing checkpointed stems")
+            self.stem_files = separation_record["artifacts"]
+            self.silent = set(separation_record["silent"])
+        else:
+            # Run demucs in-process; the engine keeps the model loaded for later songs
+            print(f"\n🔄 Splitting stems with demucs...\n")
+            with profiler.stage("separation"):
+                try:
+                    stem_audio = engine.separate_tensor(self.audio.wav)
+                except SeparationError as e:
+                    raise PipelineError(f"Demucs failed: {e}") from e
+            
+            if keep_intermediates:
+                engine.save_stems(stem_audio, self.demucs_song_dir)
+                print(f"✅ Kept demucs output in: {self.demucs_song_dir}")
+            
+            self.silent = find_silent(stem_audio, engine.samplerate, config)
+            if manifest:
+                with profiler.stage("checkpoint"):
+                    self.stem_files = manifest.save("separation", stem_audio, self._save_checkpoint,
+                                                    extension=self._extension, silent=sorted(self.silent))
+        
+        # Stem-aware analysis: tempo from the drums, key from the harmonic stems
+        if self.analysis_result is None and self.analysis_mode == "stems":
+            analysis_stems = (stems_for_analysis(stem_audio, engine.samplerate, analysis_sr) if stem_audio
+                              else load_stems_for_analysis(self.stem_files, analysis_sr))
+            self.analysis = analysis_pool.submit(
+                self._analyze, self.input_file, sr=analysis_sr, mode="stems", stems=analysis_stems
+            )
+            del analysis_stems
+        
+        # Run drum separator on the drums stem straight from memory,
+        # unless there are no drums to split
+        drumsep_record = manifest.completed("drumsep") if manifest else None
+        if drumsep_record:
+            print(f"⏩ Reusing checkpointed drum parts")
+            self.drum_part_files = drumsep_record["artifacts"]
+            self.silent |= set(drumsep_record["silent"])
+        elif self.use_drumsep and "drums" in self.silent:
+            print("🔇 Drums stem is silent, skipping drum separation")
+        elif self.use_drumsep and ("drums" in stem_audio or "drums" in self.stem_files):
+            if "drums" in stem_audio:
+                drums = stem_audio["drums"]
+            else:
+                drums = engine.read_audio(self.stem_files["drums"])
+            with profiler.stage("drumsep"):
+                drum_part_audio = run_drumsep(drums, engine.samplerate, config["tools"]["drumsep_dir"])
+            del drums
+            if drum_part_audio:
+                print("✅ Drum separation completed successfully")
+                drum_silent = find_silent(drum_part_audio, engine.samplerate, config)
+                self.silent |= drum_silent
+                if keep_intermediates:
+                    for name, part in drum_part_audio.items():
+                        os.makedirs(self.drumsep_song_dir, exist_ok=True)
+                        engine.save_audio(part, os.path.join(self.drumsep_song_dir, name))
+                    print(f"✅ Kept drumsep output in: {self.drumsep_song_dir}")
+                if manifest:
+                    with profiler.stage("checkpoint"):
+                        self.drum_part_files = manifest.save("drumsep", drum_part_audio, self._save_checkpoint,
+                                                             extension=self._extension, silent=sorted(drum_silent))
+                else:
+                    self.drum_part_audio = drum_part_audio
+        
+        # Checkpointed stems are on disk now, so finalization links them instead of writing again
+        if not manifest:
+            self.stem_audio = stem_audio
+    
+    def finish(self, open_result=True):
+        """Wait for analysis, write every output file and return the output directory."""
+        config = self.config
+        profiler = self.profiler
+        manifest = self.manifest
+        analysis_mode = self.analysis_mode
+        
+        if self.analysis is not None:
+            self.analysis_result = self.analysis.result()
+        key, camelot, tempo = self.analysis_result
+        silent = self.silent
+        
+        profiler.annotate(
+            model=self.demucs_model, analysis_mode=analysis_mode, streaming=self.streaming,
+            cache_hit=bool(self.cache_entry), key=key, camelot=camelot, bpm=tempo,
+            silent=sorted(silent)
+        )
+        
+        # Results are either in memory ({name: tensor}) or on disk ({name: path})
+        stems = dict(self.stem_files, **self.stem_audio)
+        drum_parts = dict(self.drum_part_files, **self.drum_part_audio)
+        
+        # Cached and checkpointed files must stay where they are until the song is
+        # done; streamed temp files can be renamed
+        keep_sources = bool(self.cache_entry) or self.keep_intermediates or manifest is not None
+        finalizer = Finalizer()
+        try:
+            with profiler.stage("finalization"):
+                output_dir, written_files = finalize_song(
+                    self.input_file, config, (key, camelot, tempo), stems, drum_parts,
+                    self.engine, self.audio, finalizer, keep_sources, silent
+                )
+        except Exception as e:
+            # Never leave a half-populated output folder behind
+            finalizer.rollback()
+            raise PipelineError(f"Could not write output files: {e}") from e
+        self.output_dir = output_dir
+        
+        if manifest:
+            manifest.complete("finalization", written_files, output_dir=output_dir)
+        profiler.annotate(output_dir=output_dir, output_files=sorted(written_files.values()))
+        
+        duration = self.audio.duration if self.audio is not None else self.engine.duration(self.input_file)
+        index_song(config, self.input_file, (key, camelot, tempo), duration, written_files, output_dir,
+                   analysis_mode)
+        
+        if self.use_drumsep and "drums" not in silent and not any(name.startswith("drums/") for name in written_files):
+            print("⚠️ No drum parts were produced")
+        
+        # Remember the results so a rerun can skip straight to naming
+        if self.cache and not self.cache_entry:
+            with profiler.stage("cache_store"):
+                try:
+                    if self.cache.put(self.cache_id, written_files, {
+                        "key": key, "camelot": camelot, "bpm": tempo, "analysis_mode": analysis_mode,
+                        "silent": sorted(silent)
+                    }):
+                        print(f"✅ Cached separation results")
+                    else:
+                        print(f"⏩ Not caching: the output folder can't be hardlinked into {self.cache.cache_dir}")
+                except OSError as e:
+                    print(f"⚠️ Could not write to cache: {e}")
+        
+        # Clean up streamed intermediates
+        if self.scratch_dirs:
+            with profiler.stage("cleanup"):
+                self.release_scratch()
+            print(f"✅ Cleaned up temporary files")
+        if manifest:
+            manifest.clear()
+        
+        # Drop the decoded audio and stems as soon as the files are written
+        self.audio = None
+        self.stem_audio = {}
+        self.drum_part_audio = {}
+        
+        # CHANGED: Use cross-platform folder opening
+        if open_result:
+            open_folder(output_dir)
+        
+        print(f"\n✨ All done! Your stems are ready in: {output_dir}")
+        return output_dir
+
+def index_song(config, input_file, analysis, duration, written_files, output_dir, analysis_mode):
+    """Add a finished song's key, BPM, duration and stems to the library index."""
+    key, camelot, tempo = analysis
+    # Failed analyses aren't recorded, so the next --index retries them
+    if not config["library"]["enabled"] or not camelot:
+        return
+    stems = []
+    for name in written_files:
+        folder, filename = name.split("/", 1)
+        base = os.path.splitext(filename)[0]
+        stems.append(base if folder == "stems" else DRUM_PARTS.get(base + ".wav", base).lower())
     try:
-        key, camelot, tempo = detect_key_and_tempo(input_file)
-        print(f"Detected key: {key} ({camelot}), tempo: {tempo} BPM")
-    except Exception as e:
-        print(f"⚠️ Error detecting key and tempo: {e}")
-        print("Using default values")
-        key, camelot, tempo = "Unknown", "", 0
+        index = LibraryIndex(config["library"]["db"])
+        try:
+            index.record(input_file, key, camelot, tempo, duration, stems, output_dir, analysis_mode)
+        finally:
+            index.close()
+    except (sqlite3.Error, OSError) as e:
+        print(f"⚠️ Could not update the library index: {e}")
+
+def _analyze_for_index(input_file, mode):
+    """Key, Camelot code, tempo and duration of one file; raises if it can't be analyzed."""
+    import librosa
+    
+    y, sr = librosa.load(input_file, sr=ANALYSIS_SAMPLE_RATES[mode])
+    key, camelot, tempo = ANALYZERS[mode](input_file, y=y, sr=sr)
+    return key, camelot, tempo, len(y) / sr
+
+def index_library(inputs, config):
+    """Analyze new and changed audio files into the library index, without splitting them.
+
+    Files whose size and mtime (or, failing that, content hash) match the
+    index are skipped, and entries for files deleted from the scanned
+    folders are dropped. Returns True if every file could be analyzed.
+    """
+    # Stem-aware analysis needs separated stems, so indexing analyzes the mix
+    mode = config["analysis"]["mode"] if config["analysis"]["mode"] in ANALYZERS else "accurate"
+    input_files = collect_input_files(inputs)
+    index = LibraryIndex(config["library"]["db"])
+    failed = []
+    try:
+        pruned = sum(index.prune(os.path.expanduser(item)) for item in inputs
+                     if os.path.isdir(os.path.expanduser(item)))
+        pending = {}
+        for input_file in input_files:
+            try:
+                content_hash = index.refresh(input_file)
+            except OSError as e:
+                failed.append((input_file, str(e)))
+                continue
+            if content_hash:
+                pending[input_file] = content_hash
+        print(f"📚 {len(input_files) - len(pending) - len(failed)} file(s) up to date, "
+              f"{pruned} removed, analyzing {len(pending)} ({mode})")
+        
+        workers, _ = plan_workers(len(pending), config["batch"]["workers"])
+        context = multiprocessing.get_context("spawn")
+        with ProcessPoolExecutor(max_workers=workers, mp_context=context) as pool:
+            futures = {pool.submit(_analyze_for_index, input_file, mode): input_file for input_file in pending}
+            for future in as_completed(futures):
+                input_file = futures[future]
+                try:
+                    key, camelot, tempo, duration = future.result()
+                except Exception as e:
+                    # Not recorded, so the next rescan tries again
+                    failed.append((input_file, str(e)))
+                    print(f"⚠️ Could not analyze {os.path.basename(input_file)}: {e}")
+                    continue
+                index.record(input_file, key, camelot, tempo, duration, analysis_mode=mode,
+                             content_hash=pending[input_file])
+                print(f"✅ {os.path.basename(input_file)}: {key} ({camelot}), {tempo} BPM")
+        print(f"📚 Library index: {index.count()} track(s) in {config['library']['db']}")
+    finally:
+        index.close()
+    return not failed
+
+def camelot_code(value):
+    """Turn a Camelot code ("8A") or key name ("Am", "F#") into a Camelot code, or None."""
+    value = value.strip()
+    if value in CAMELOT_MAP:
+        return CAMELOT_MAP[value]
+    match = re.fullmatch(r"(1[0-2]|[1-9])([ABab])", value)
+    return f"{match.group(1)}{match.group(2).upper()}" if match else None
+
+def find_compatible(config, key, bpm=None, bpm_range=None, limit=None):
+    """Print indexed tracks that mix with key (and bpm) and return them."""
+    camelot = camelot_code(key) if key else None
+    if key and not camelot:
+        raise PipelineError(f"Unknown key or Camelot code: {key}")
+    bpm_range = config["library"]["bpm_range"] if bpm_range is None else bpm_range
+    index = LibraryIndex(config["library"]["db"])
+    try:
+        start = time.perf_counter()
+        tracks = index.query(camelot, bpm, bpm_range, limit)
+        elapsed_ms = (time.perf_counter() - start) * 1000
+    finally:
+        index.close()
+    for track in tracks:
+        stems = f"  [{', '.join(track['stems'])}]" if track["stems"] else ""
+        print(f"{track['camelot']:>4}  {track['bpm'] or 0:6.1f} BPM  {track['key']:<4} {track['path']}{stems}")
+    target = " ".join(part for part in (camelot, f"{bpm:g}±{bpm_range:g} BPM" if bpm else None) if part)
+    print(f"🎛️ {len(tracks)} track(s) compatible with {target or 'anything'} ({elapsed_ms:.1f} ms)")
+    return tracks
+
+def split_song(input_file, config, open_result=True, profiler=None):
+    """Run the full pipeline for one song and return its output directory.
+
+    The input is decoded once and the same buffer feeds analysis, demucs and
+    drumsep. Intermediate WAVs are only written with keep_intermediates.
+    Each stage is measured by profiler when one is given.
+    Raises PipelineError instead of exiting so batch runs can carry on.
+    """
+    song = SongRun(input_file, config, profiler)
+    try:
+        with ThreadPoolExecutor(max_workers=1) as analysis_pool:
+            if not song.prepare(analysis_pool):
+                return song.output_dir
+            song.separate(analysis_pool)
+            return song.finish(open_result)
+    finally:
+        song.release_scratch()
+
+def preview_song(input_file, config, seconds, full=False, open_result=True, profiler=None):
+    """Write a quick preview of a song's stems, then optionally split the whole song.
+
+    With full, decoding, the cache lookup and key/BPM analysis start before
+    the preview, so analysis runs while the excerpt is separated and the
+    full run reuses both. Returns the preview folder, or the output
+    directory when the whole song was split.
+    """
+    song = SongRun(input_file, config, profiler)
+    if not full:
+        preview_dir = song.preview(seconds)
+        if open_result:
+            open_folder(preview_dir)
+        return preview_dir
+    
+    try:
+        with ThreadPoolExecutor(max_workers=1) as analysis_pool:
+            if not song.prepare(analysis_pool):
+                return song.output_dir
+            preview_dir = song.preview(seconds)
+            if open_result:
+                open_folder(preview_dir)
+            print(f"\n🔄 Preview done, splitting the whole song...\n")
+            song.separate(analysis_pool)
+            return song.finish(open_result=False)
+    finally:
+        song.release_scratch()
+
+def song_output_dir(config, file_data):
+    """Folder a song's files go in, named after the song when organize_by_song is on."""
+    if not config["output"]["organize_by_song"]:
+        return config["paths"]["output_dir"]
+    if config["output"]["include_key_bpm"]:
+        formatted_name_base = format_filename(
+            config["output"]["filename_format"].replace(" - ({stem})", ""), 
+            file_data
+        )
+    else:
+        formatted_name_base = file_data["name"]
+    return os.path.join(config["paths"]["output_dir"], formatted_name_base)
+
+def finalize_song(input_file, config, analysis, stems, drum_parts, engine, audio,
+                  finalizer, keep_sources=False, silent=()):
+    """Name and place every output file for a song.
+
+    stems and drum_parts map names to tensors (written out) or file paths
+    (linked or moved into place, never written twice). Names in silent are
+    skipped or labelled "Silent ..." depending on silence.action. Returns
+    (output_dir, {cache name: path}).
+    """
+    key, camelot, tempo = analysis
+    song_name = get_song_name(input_file)
+    demucs_model = config["tools"].get("demucs_model", "htdemucs_6s")
+    place = finalizer.link if keep_sources else finalizer.move
+    skip_silent = config["silence"]["action"] == "skip"
     
     # Format data for filenames
     file_data = {
@@ -272,148 +1478,795 @@ def main():
         "stem": ""  # Will be replaced for each stem
     }
     
-    # Create formatted song name
-    if config["output"]["include_key_bpm"]:
-        formatted_name_base = format_filename(
-            config["output"]["filename_format"].replace(" - ({stem})", ""), 
-            file_data
-        )
-    else:
-        formatted_name_base = song_name
+    output_dir = song_output_dir(config, file_data)
+    os.makedirs(output_dir, exist_ok=True)
+    
+    # Get stem types for the selected model or use default
+    stem_types = MODEL_STEMS.get(demucs_model, ["bass", "drums", "other", "vocals"])
+    print(f"Looking for stems: {', '.join(stem_types)}")
+    
+    opts = output_options(config)
+    ext = output_extension(opts["output_format"])
+    
+    # Files written for this song, used to fill the cache: {cache name: path}
+    written_files = {}
+    # Tensors still to be encoded: (destination, write function, message)
+    encodes = []
+    
+    def add_output(source, dest_file, message, clip="rescale"):
+        if isinstance(source, str):
+            place(source, dest_file)
+            print(message)
+        else:
+            encodes.append((dest_file, lambda tmp: engine.save_audio(source, tmp, clip=clip, **opts), message))
     
-    # Set up output directory
-    if config["output"]["organize_by_song"]:
-        output_dir = os.path.join(config["paths"]["output_dir"], formatted_name_base)
+    # Write the stems under their final names
+    for stem_type in stem_types:
+        if stem_type in silent and skip_silent:
+            print(f"🔇 Skipped silent stem: {stem_type}")
+            continue
+        source = stems.get(stem_type)
+        if source is None:
+            print(f"⚠️ Stem not found: {stem_type}")
+            continue
+        file_data["stem"] = f"Silent {stem_type.title()}" if stem_type in silent else stem_type.title()
+        formatted_name = format_filename(config["output"]["filename_format"], file_data)
+        dest_file = os.path.join(output_dir, f"{formatted_name}{ext}")
+        add_output(source, dest_file, f"✅ Saved: {dest_file}")
+        written_files[f"stems/{stem_type}{ext}"] = dest_file
+    
+    # Add the original as the full track: reused if it's already exactly in the output format, converted otherwise
+    file_data["stem"] = "Full Track"
+    formatted_name = format_filename(config["output"]["filename_format"], file_data)
+    full_track_file = os.path.join(output_dir, f"{formatted_name}{ext}")
+    message = f"✅ Added original file as: {full_track_file}"
+    if (os.path.splitext(input_file)[1].lower() == ext and
+            matches_output_format(input_file, engine.samplerate, engine.audio_channels, opts["output_format"])):
+        if config["output"]["link_full_track"]:
+            finalizer.link(input_file, full_track_file)
+        else:
+            # A hardlink would let an in-place edit of the full track change the user's original
+            finalizer.write(full_track_file, lambda tmp: shutil.copyfile(input_file, tmp))
+        print(message)
+    elif audio is not None:
+        add_output(audio.wav, full_track_file, message, clip="clamp")
     else:
-        output_dir = config["paths"]["output_dir"]
+        encodes.append((full_track_file, lambda tmp: engine.transcode_file(input_file, tmp, **opts), message))
     
-    os.makedirs(output_dir, exist_ok=True)
+    # Write drum parts to follow our naming convention
+    for source_name, target_stem in DRUM_PARTS.items():
+        source = drum_parts.get(source_name)
+        if source is None:
+            continue
+        if source_name in silent:
+            if skip_silent:
+                print(f"🔇 Skipped silent drum part: {target_stem}")
+                continue
+            target_stem = f"Silent {target_stem}"
+        file_data["stem"] = target_stem
+        part_name = format_filename(config["output"]["filename_format"], file_data)
+        target_file = os.path.join(output_dir, f"{part_name}{ext}")
+        add_output(source, target_file, f"✅ Added drum part: {part_name}{ext}")
+        written_files[f"drums/{os.path.splitext(source_name)[0]}{ext}"] = target_file
     
-    # Get the demucs model from config
-    demucs_model = config["tools"].get("demucs_model", "htdemucs_6s")
-    print(f"Using demucs model: {demucs_model}")
+    # Encode everything at once; libsndfile releases the GIL while it encodes
+    with ThreadPoolExecutor(max_workers=max(1, config["output"]["writer_threads"])) as writers:
+        futures = {writers.submit(finalizer.write, dest, write_fn): message
+                   for dest, write_fn, message in encodes}
+        for future in as_completed(futures):
+            future.result()
+            print(futures[future])
     
-    # Run demucs
-    demucs_output_dir = os.path.join(config["paths"]["temp_dir"], demucs_model)
-    demucs_cmd = f'demucs -n {demucs_model} --out "{config["paths"]["temp_dir"]}" "{input_file}"'
+    return output_dir, written_files
+
+def read_playlist(playlist_path):
+    """Return the audio files listed in an .m3u/.m3u8/.txt playlist."""
+    playlist_dir = os.path.dirname(os.path.abspath(playlist_path))
+    files = []
+    with open(playlist_path, 'r', encoding='utf-8-sig') as playlist:
+        for line in playlist:
+            line = line.strip()
+            if not line or line.startswith("#"):
+                continue
+            # Playlist entries are relative to the playlist itself
+            files.append(os.path.normpath(os.path.join(playlist_dir, os.path.expanduser(line))))
+    return files
+
+def collect_input_files(inputs):
+    """Expand files, directories, glob patterns and playlists into audio files."""
+    files = []
+    for item in inputs:
+        item = os.path.expanduser(item)
+        if os.path.isdir(item):
+            for name in sorted(os.listdir(item)):
+                if os.path.splitext(name)[1].lower() in AUDIO_EXTENSIONS:
+                    files.append(os.path.join(item, name))
+        elif os.path.splitext(item)[1].lower() in PLAYLIST_EXTENSIONS and os.path.isfile(item):
+            files.extend(read_playlist(item))
+        elif glob.has_magic(item):
+            files.extend(f for f in sorted(glob.glob(item, recursive=True))
+                         if os.path.splitext(f)[1].lower() in AUDIO_EXTENSIONS)
+        else:
+            files.append(item)
     
-    if not run_command(demucs_cmd, "Splitting stems with demucs"):
-        print("⚠️ Demucs failed. Aborting.")
-        sys.exit(1)
+    # Keep the first occurrence of each file
+    unique_files = []
+    seen = set()
+    for f in files:
+        f = os.path.abspath(f)
+        if f not in seen:
+            seen.add(f)
+            unique_files.append(f)
+    return unique_files
+
+def plan_workers(num_files, workers, threads_per_worker=0):
+    """Split the machine's cores between worker processes.
+
+    Returns (workers, torch threads per worker).
+    """
+    cpu_count = os.cpu_count() or 1
+    workers = max(1, min(workers or 1, num_files, cpu_count))
+    threads = threads_per_worker or max(1, cpu_count // workers)
+    return workers, threads
+
+def _init_batch_worker(threads):
+    """Pin torch's intra-op thread pool so workers don't oversubscribe the CPU."""
+    configure_threads(threads)
+
+def _split_song_worker(input_file, config, profile=False):
+    """Batch worker entry point: returns (input_file, output_dir, error, report)."""
+    profiler = RunProfiler(get_song_name(input_file), enabled=profile)
+    try:
+        output_dir = split_song(input_file, config, open_result=False, profiler=profiler)
+        return input_file, output_dir, None, profiler.report() if profile else None
+    except Exception as e:
+        return input_file, None, str(e), profiler.report() if profile else None
+
+class MemoryBudget:
+    """Blocks new songs from entering the pipeline while the ones in flight would exceed a byte limit.
+
+    A song is always let in when nothing else is in flight, however large it is.
+    """
     
-    # Find the created demucs folder
-    demucs_song_dir = os.path.join(demucs_output_dir, song_name)
-    if not os.path.exists(demucs_song_dir):
-        print(f"⚠️ Demucs output directory not found at {demucs_song_dir}")
-        print("Check if demucs ran successfully.")
-        sys.exit(1)
+    def __init__(self, limit_bytes):
+        self.limit = limit_bytes
+        self.used = 0
+        self._changed = threading.Condition()
     
-    # Determine which stems to look for based on the model
-    demucs_model = config["tools"]["demucs_model"]
+    def acquire(self, amount):
+        with self._changed:
+            while self.limit and self.used and self.used + amount > self.limit:
+                self._changed.wait()
+            self.used += amount
     
-    # Define stems available for each model
-    model_stems = {
-        "htdemucs": ["bass", "drums", "other", "vocals"],
-        "htdemucs_6s": ["bass", "drums", "other", "vocals", "piano", "guitar"],
-        "htdemucs_ft": ["bass", "drums", "other", "vocals"],
-        "mdx_extra": ["bass", "drums", "other", "vocals"],
-        "mdx_extra_q": ["bass", "drums", "other", "vocals"]
-    }
+    def release(self, amount):
+        with self._changed:
+            self.used -= amount
+            self._changed.notify_all()
+
+def run_pipelined(input_files, config, profile=False):
+    """Process songs in one process with decode, separation and finalization overlapping.
+
+    While song N is being separated, the next songs are decoded and analyzed
+    and the previous ones are written out, so the model is rarely idle.
+    Songs are handed between stages through bounded queues and only enter
+    the pipeline while pipeline.max_memory_mb allows. Returns the same
+    per-file results as run_batch().
+    """
+    settings = config["pipeline"]
+    decode_workers = max(1, settings["decode_workers"])
+    finalize_workers = max(1, settings["finalize_workers"])
+    budget = MemoryBudget(int(settings["max_memory_mb"] * 1024 * 1024))
+    # A sentinel per producing thread tells the next stage there's nothing more to come
+    done = object()
+    pending_files = queue.Queue()
+    to_separate = queue.Queue(maxsize=max(1, settings["queue_size"]))
+    to_finalize = queue.Queue(maxsize=max(1, settings["queue_size"]))
+    results = []
+    results_lock = threading.Lock()
     
-    # Get stem types for the selected model or use default
-    stem_types = model_stems.get(demucs_model, ["bass", "drums", "other", "vocals"])
-    print(f"Looking for stems: {', '.join(stem_types)}")
+    for input_file in input_files:
+        pending_files.put(input_file)
     
-    # Rename the stems from demucs
-    for stem_type in stem_types:
-        source_file = os.path.join(demucs_song_dir, f"{stem_type}.wav")
-        if os.path.exists(source_file):
-            file_data["stem"] = stem_type.title()
-            formatted_name = format_filename(config["output"]["filename_format"], file_data)
-            dest_file = os.path.join(output_dir, f"{formatted_name}.wav")
-            shutil.copy2(source_file, dest_file)
-            print(f"✅ Copied and renamed: {dest_file}")
-        else:
-            print(f"⚠️ Stem not found: {stem_type}.wav")
+    def record(input_file, profiler, output_dir=None, error=None):
+        with results_lock:
+            results.append((input_file, output_dir, error, profiler.report() if profile else None))
     
-    # Copy and rename the original file
-    file_data["stem"] = "Full Track"
-    formatted_name = format_filename(config["output"]["filename_format"], file_data)
-    full_track_file = os.path.join(output_dir, f"{formatted_name}.wav")
-    shutil.copy2(input_file, full_track_file)
-    print(f"✅ Copied original file as: {full_track_file}")
+    def decode_stage():
+        while True:
+            try:
+                input_file = pending_files.get_nowait()
+            except queue.Empty:
+                to_separate.put(done)
+                return
+            profiler = RunProfiler(get_song_name(input_file), enabled=profile)
+            estimate = 0
+            try:
+                song = SongRun(input_file, config, profiler)
+                estimate = song.memory_estimate()
+                budget.acquire(estimate)
+                if not song.prepare(analysis_pool):
+                    budget.release(estimate)
+                    record(input_file, profiler, song.output_dir)
+                    continue
+            except Exception as e:
+                budget.release(estimate)
+                record(input_file, profiler, error=str(e))
+                continue
+            to_separate.put((song, estimate))
     
-    # Run drum separator on the drums stem if available
-    # After processing the main stems with demucs, always run drum separation
-    file_data["stem"] = "Drums"
-    formatted_name = format_filename(config["output"]["filename_format"], file_data)
-    drums_file = os.path.join(output_dir, f"{formatted_name}.wav")
+    def finalize_stage():
+        while True:
+            item = to_finalize.get()
+            if item is done:
+                return
+            song, estimate = item
+            try:
+                record(song.input_file, song.profiler, song.finish(open_result=False))
+            except Exception as e:
+                record(song.input_file, song.profiler, error=str(e))
+            finally:
+                song.release_scratch()
+                budget.release(estimate)
+    
+    with ThreadPoolExecutor(max_workers=max(1, settings["analysis_workers"])) as analysis_pool:
+        threads = [threading.Thread(target=decode_stage, daemon=True) for _ in range(decode_workers)]
+        threads += [threading.Thread(target=finalize_stage, daemon=True) for _ in range(finalize_workers)]
+        for thread in threads:
+            thread.start()
+        
+        # Separation stays on this thread, one song at a time, using all of torch's threads
+        finished_decoders = 0
+        while finished_decoders < decode_workers:
+            item = to_separate.get()
+            if item is done:
+                finished_decoders += 1
+                continue
+            song, estimate = item
+            try:
+                song.separate(analysis_pool)
+            except Exception as e:
+                song.release_scratch()
+                budget.release(estimate)
+                record(song.input_file, song.profiler, error=str(e))
+                continue
+            to_finalize.put(item)
+        
+        for _ in range(finalize_workers):
+            to_finalize.put(done)
+        for thread in threads:
+            thread.join()
+    return results
 
-    print(f"Running drum separation on {formatted_name}.wav...")
+def run_batch(input_files, config, profile=False):
+    """Process many songs, one model per worker, and return per-file results."""
+    workers, threads = plan_workers(
+        len(input_files),
+        config["batch"]["workers"],
+        config["batch"]["threads_per_worker"]
+    )
+    print(f"Processing {len(input_files)} files with {workers} worker(s), {threads} thread(s) each")
+    
+    results = []
+    if workers == 1:
+        # Run in this process so the engine stays warm across songs
+        configure_threads(threads)
+        if config["pipeline"]["enabled"]:
+            # Load the model up front so the pipeline's threads share one copy
+            try:
+                configure_engine(get_engine(config["tools"]["demucs_model"]), config).load()
+            except SeparationError as e:
+                return [(input_file, None, str(e), None) for input_file in input_files]
+            return run_pipelined(input_files, config, profile)
+        for input_file in input_files:
+            results.append(_split_song_worker(input_file, config, profile))
+        return results
+    
+    # Spawn keeps each worker's torch state independent of the parent
+    context = multiprocessing.get_context("spawn")
+    
+    def start_pool():
+        return ProcessPoolExecutor(max_workers=workers, mp_context=context,
+                                   initializer=_init_batch_worker, initargs=(threads,))
+    
+    # Only as many songs as workers are handed out at a time, so a worker that
+    # dies takes just the songs that were running with it
+    pending = list(input_files)
+    attempts = {}
+    running = {}
+    pool = start_pool()
+    try:
+        while pending or running:
+            while pending and len(running) < workers:
+                input_file = pending.pop(0)
+                attempts[input_file] = attempts.get(input_file, 0) + 1
+                running[pool.submit(_split_song_worker, input_file, config, profile)] = input_file
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+            broken = any(isinstance(future.exception(), BrokenProcessPool) for future in done)
+            if broken:
+                # A worker died (e.g. out of memory), which takes every running song with it
+                done = list(running)
+            for future in done:
+                input_file = running.pop(future)
+                name = os.path.basename(input_file)
+                if broken:
+                    if attempts[input_file] < BATCH_ATTEMPTS:
+                        print(f"⚠️ Worker process died while splitting {name}, retrying")
+                        pending.append(input_file)
+                    else:
+                        results.append((input_file, None, "Worker process died", None))
+                elif future.exception():
+                    results.append((input_file, None, str(future.exception()), None))
+                else:
+                    results.append(future.result())
+            if broken:
+                pool.shutdown(wait=False)
+                # The dead worker couldn't clean up after itself
+                collect_scratch_orphans(config)
+                pool = start_pool()
+    finally:
+        pool.shutdown(wait=False)
+    return results
 
-    # Directly call drumsep.py with proper paths
-    drumsep_py = os.path.join(config["tools"]["drumsep_dir"], "drumsep.py")
-    drumsep_cmd = f'python "{drumsep_py}" "{drums_file}" "{output_dir}"'
+def print_batch_summary(results):
+    """Print which songs succeeded and which failed."""
+    failed = [(f, error) for f, _, error, _ in results if error]
+    print(f"\n📋 Batch summary: {len(results) - len(failed)} succeeded, {len(failed)} failed")
+    for input_file, output_dir, error, _ in results:
+        if error:
+            print(f"⚠️ {os.path.basename(input_file)}: {error}")
+        else:
+            print(f"✅ {os.path.basename(input_file)} -> {output_dir}")
+    return not failed
 
-    # Run the command
-    success = run_command(drumsep_cmd, "Splitting drum stems")
+def scan_watch_folder(watch_dir, config, seen):
+    """Return [(file, priority)] for audio files in watch_dir that have finished writing.
 
-    # Initialize model_id_folder variable
-    model_id = "49469ca8"
-    model_id_folder = os.path.join(output_dir, model_id)
+    A file counts as finished once its size and mtime haven't changed for
+    watch.settle_seconds. seen carries each file's state between scans.
+    Files in a subfolder listed in watch.priority_folders get that priority.
+    """
+    now = time.time()
+    settle_seconds = config["watch"]["settle_seconds"]
+    priority_folders = config["watch"]["priority_folders"] or {}
+    # Don't pick up our own output if it's written inside the watched folder
+    skip_dirs = tuple(os.path.abspath(config["paths"][name]) + os.sep for name in ("output_dir", "temp_dir"))
+    
+    ready = []
+    present = set()
+    for root, dirs, files in os.walk(watch_dir):
+        if (os.path.abspath(root) + os.sep).startswith(skip_dirs):
+            dirs[:] = []
+            continue
+        dirs[:] = [d for d in dirs if not d.startswith(".")]
+        for name in files:
+            if name.startswith(".") or os.path.splitext(name)[1].lower() not in AUDIO_EXTENSIONS:
+                continue
+            path = os.path.abspath(os.path.join(root, name))
+            try:
+                stat = os.stat(path)
+            except OSError:
+                continue
+            present.add(path)
+            state = (stat.st_size, stat.st_mtime_ns)
+            previous = seen.get(path)
+            if previous is None or previous["state"] != state:
+                seen[path] = {"state": state, "since": now, "queued": False}
+            elif not previous["queued"] and now - previous["since"] >= settle_seconds:
+                previous["queued"] = True
+                folder = os.path.relpath(path, watch_dir).split(os.sep)[0]
+                ready.append((path, priority_folders.get(folder, 0)))
     
-    # Initialize subfolders list
-    subfolders = []
+    # Forget files that were moved or deleted
+    for path in set(seen) - present:
+        del seen[path]
+    return ready
 
-    if success:
-        print("✅ Drum separation completed successfully")
-        
-        if os.path.exists(model_id_folder):
-            print(f"Found drum separation folder: {model_id_folder}")
+def watch_folder(watch_dir, config):
+    """Split every audio file that appears in watch_dir until interrupted.
+
+    New files are added to a persistent SQLite queue and drained by a pool
+    of worker processes that keep their models loaded between songs.
+    Failed songs are retried with backoff; jobs that were running when the
+    daemon stopped are picked up again on the next start.
+    """
+    watch = config["watch"]
+    watch_dir = os.path.abspath(os.path.expanduser(watch_dir))
+    if not os.path.isdir(watch_dir):
+        raise PipelineError(f"Watch folder {watch_dir} not found.")
+    
+    job_queue = JobQueue(watch["queue_db"], watch["max_attempts"], watch["retry_delay_seconds"])
+    recovered = job_queue.recover()
+    if recovered:
+        print(f"♻️ Requeued {recovered} job(s) that were running when the daemon last stopped")
+    
+    workers, threads = plan_workers(os.cpu_count() or 1, config["batch"]["workers"],
+                                    config["batch"]["threads_per_worker"])
+    context = multiprocessing.get_context("spawn")
+    
+    def start_pool():
+        return ProcessPoolExecutor(max_workers=workers, mp_context=context,
+                                   initializer=_init_batch_worker, initargs=(threads,))
+    
+    print(f"👀 Watching {watch_dir} with {workers} worker(s), {threads} thread(s) each (Ctrl+C to stop)")
+    print(f"Job queue: {watch['queue_db']}")
+    pool = start_pool()
+    running = {}
+    seen = {}
+    try:
+        while True:
+            for path, priority in scan_watch_folder(watch_dir, config, seen):
+                try:
+                    job_id = job_queue.enqueue(path, priority)
+                except OSError as e:
+                    # Renamed or deleted since the scan; a new name is picked up by the next one
+                    print(f"⚠️ Skipped {os.path.basename(path)}: {e}")
+                    seen.pop(path, None)
+                    continue
+                if job_id is not None:
+                    print(f"📥 Queued {os.path.basename(path)}" + (f" (priority {priority})" if priority else ""))
             
-            # Look for the subfolder with the actual separated drum parts
-            subfolders = [d for d in os.listdir(model_id_folder) 
-                        if os.path.isdir(os.path.join(model_id_folder, d))]
-        else:
-            print(f"⚠️ Drumsep output folder not found at: {model_id_folder}")
-    
-    if subfolders:
-        # Rename the files to follow our naming convention
-        drum_folder = os.path.join(model_id_folder, subfolders[0])
-        
-        # Map Spanish names to English
-        drum_parts = {
-            "bombo.wav": "Kick",
-            "platillos.wav": "Hats",
-            "redoblante.wav": "Snare-Clap",
-            "toms.wav": "Toms"
-        }
-        
-        # Copy and rename files
-        for source_name, target_stem in drum_parts.items():
-            source_file = os.path.join(drum_folder, source_name)
-            if os.path.exists(source_file):
-                file_data["stem"] = target_stem
-                part_name = format_filename(config["output"]["filename_format"], file_data)
-                target_file = os.path.join(output_dir, f"{part_name}.wav")
-                shutil.copy2(source_file, target_file)
-                print(f"✅ Added drum part: {part_name}.wav")
-        
-        # Clean up the temporary folder
-        shutil.rmtree(model_id_folder)
-        print(f"✅ Cleaned up temporary files")
+            # Keep every worker busy
+            while len(running) < workers:
+                job = job_queue.claim()
+                if job is None:
+                    break
+                attempt = f" (attempt {job['attempts']})" if job["attempts"] > 1 else ""
+                print(f"🔄 Starting {os.path.basename(job['input_file'])}{attempt}")
+                running[pool.submit(_split_song_worker, job["input_file"], config)] = job
+            
+            if not running:
+                time.sleep(watch["poll_seconds"])
+                continue
+            done, _ = wait(running, timeout=watch["poll_seconds"], return_when=FIRST_COMPLETED)
+            broken = any(isinstance(future.exception(), BrokenProcessPool) for future in done)
+            if broken:
+                # A worker died (e.g. out of memory), which takes every running song with it
+                done = list(running)
+            for future in done:
+                job = running.pop(future)
+                if broken:
+                    output_dir, error = None, "Worker process died"
+                elif future.exception():
+                    output_dir, error = None, str(future.exception())
+                else:
+                    _, output_dir, error, _ = future.result()
+                name = os.path.basename(job["input_file"])
+                if error is None:
+                    job_queue.finish(job["id"], output_dir)
+                    print(f"✅ {name} -> {output_dir}")
+                elif job_queue.fail(job["id"], error):
+                    print(f"⚠️ {name} failed, will retry: {error}")
+                else:
+                    print(f"❌ {name} failed after {job['attempts']} attempt(s): {error}")
+            if broken:
+                pool.shutdown(wait=False)
+                # The dead worker couldn't clean up after itself
+                collect_scratch_orphans(config)
+                pool = start_pool()
+    except KeyboardInterrupt:
+        print("\n🛑 Stopping, unfinished jobs will resume on the next start")
+        for job in running.values():
+            job_queue.release(job["id"])
+    finally:
+        pool.shutdown(wait=False)
+        counts = job_queue.counts()
+        print("📋 Queue: " + ", ".join(f"{n} {status}" for status, n in sorted(counts.items())))
+        job_queue.close()
+
+# Progress queue shared with the HTTP server, set in each server worker
+_server_events = None
+
+def _init_server_worker(threads, events, config):
+    """Server worker set-up: pin threads and load both models before the first upload."""
+    global _server_events
+    _server_events = events
+    configure_threads(threads)
+    try:
+        configure_engine(get_engine(config["tools"]["demucs_model"]), config).load()
+        configure_engine(load_drumsep_module(config["tools"]["drumsep_dir"]).get_drum_engine(), config).load()
+    except Exception as e:
+        print(f"⚠️ Could not preload models: {e}")
+
+def _serve_job(job_id, input_file, config):
+    """Server worker entry point: returns (output_dir, error, report) and reports progress."""
+    def emit(event):
+        _server_events.put(dict(event, job=job_id))
+    
+    # Uploads are deleted once the job ends, so they don't belong in the library index
+    config = copy.deepcopy(config)
+    config["library"]["enabled"] = False
+    profiler = RunProfiler(get_song_name(input_file), on_event=emit)
+    emit({"event": "started"})
+    try:
+        output_dir = split_song(input_file, config, open_result=False, profiler=profiler)
+        return output_dir, None, profiler.report()
+    except Exception as e:
+        return None, str(e), profiler.report()
+
+def write_profile_reports(report_dir, results, run_profiler, elapsed_seconds):
+    """Write one JSON report per song plus an aggregate for the whole run."""
+    reports = [report for _, _, _, report in results if report]
+    for report in reports:
+        write_report(report, os.path.join(report_dir, f"{report['name']}.json"))
+    summary = aggregate_reports(reports, elapsed_seconds)
+    summary["run"] = run_profiler.report()
+    summary_path = os.path.join(report_dir, "run_report.json")
+    write_report(summary, summary_path)
+    print(f"📊 Wrote profile reports to {report_dir}")
+    if summary["real_time_factor"] is not None:
+        print(f"📊 {summary['songs']} song(s), {summary['audio_seconds']:.0f}s of audio, "
+              f"real-time factor {summary['real_time_factor']:.3f}")
+    return summary_path
+
+def dry_run(input_files, config):
+    """Print the stems and output files a run would produce, without loading any model.
+
+    Only looks at the config and the file system. Returns False if a real
+    run couldn't start: missing modules, missing inputs or a bad filename_format.
+    """
+    ready = True
+    missing = missing_modules()
+    if missing:
+        print(f"❌ Not installed: {', '.join(missing)}")
+        ready = False
+    
+    demucs_model = config["tools"]["demucs_model"]
+    stem_types = MODEL_STEMS.get(demucs_model)
+    if stem_types is None:
+        stem_types = ["bass", "drums", "other", "vocals"]
+        print(f"⚠️ Unknown demucs model {demucs_model}, assuming stems: {', '.join(stem_types)}")
+    else:
+        print(f"Model: {demucs_model} ({', '.join(stem_types)})")
+    
+    names = [stem_type.title() for stem_type in stem_types] + ["Full Track"]
+    drumsep_py = os.path.join(config["tools"]["drumsep_dir"], "drumsep.py")
+    if os.path.exists(drumsep_py):
+        names += list(DRUM_PARTS.values())
     else:
-        print("⚠️ No subfolders found in drumsep output")
+        print(f"⚠️ Drumsep script not found at {drumsep_py}, drum parts will be skipped")
     
-    # Clean up original demucs output directory
-    if os.path.exists(demucs_song_dir):
-        shutil.rmtree(demucs_song_dir)
-        print(f"✅ Cleaned up demucs output directory: {demucs_song_dir}")
+    profile = performance_profile(config)
+    print(f"Performance: {config['performance']['profile']} "
+          f"(shifts {profile['shifts']}, overlap {profile['overlap']}, int8 {'on' if profile['quantize'] else 'off'})")
     
-    # CHANGED: Use cross-platform folder opening
-    open_folder(output_dir)
+    ext = output_extension(config["output"]["format"])
+    print(f"Output: {config['output']['format']} files in {config['paths']['output_dir']}")
     
-    print(f"\n✨ All done! Your stems are ready in: {output_dir}")
+    for input_file in input_files:
+        if not os.path.isfile(input_file):
+            print(f"❌ Input not found: {input_file}")
+            ready = False
+            continue
+        # Key and tempo are only known after analysis
+        file_data = {"key": "<key>", "camelot": "<camelot>", "bpm": "<bpm>",
+                     "name": get_song_name(input_file), "stem": ""}
+        try:
+            print(f"\n🎵 {input_file}\n   → {song_output_dir(config, file_data)}")
+            for name in names:
+                file_data["stem"] = name
+                print(f"   {format_filename(config['output']['filename_format'], file_data)}{ext}")
+        except (KeyError, IndexError, ValueError) as e:
+            print(f"❌ Invalid output.filename_format: {e}")
+            return False
+    return ready
+
+def main():
+    # Parse command line arguments
+    parser = argparse.ArgumentParser(description="Split audio into stems with key and BPM detection")
+    parser.add_argument("inputs", nargs="*", metavar="input",
+                        help="Audio files, directories, glob patterns or playlists (.m3u/.m3u8/.txt) to process")
+    parser.add_argument("-c", "--config", help="Path to config file")
+    parser.add_argument("-o", "--output", help="Override output directory")
+    parser.add_argument("-m", "--model", help="Override demucs model (e.g., htdemucs, htdemucs_6s, mdx_extra)")
+    parser.add_argument("--analysis", choices=sorted(ANALYSIS_SAMPLE_RATES),
+                        help="Key/BPM analysis mode: accurate (default), fast, or stems")
+    parser.add_argument("--compare-analysis", action="store_true",
+                        help="Only compare fast and accurate analysis on the inputs and report agreement")
+    parser.add_argument("-j", "--jobs", type=int, help="Number of worker processes for batch runs")
+    parser.add_argument("--threads", type=int, help="Torch threads per worker (default: cores / jobs)")
+    parser.add_argument("--performance", metavar="PROFILE",
+                        help="Speed/quality profile from the performance section: fast, balanced (default) or quality")
+    parser.add_argument("--stream", action="store_true",
+                        help="Separate in segments with bounded memory, whatever the input length")
+    parser.add_argument("--format", choices=sorted(OUTPUT_FORMATS),
+                        help="Output encoding: wav16 (default), wav24, float32, flac or flac24")
+    parser.add_argument("--keep-intermediates", action="store_true",
+                        help="Also write raw demucs and drumsep output to temp_dir")
+    parser.add_argument("--keep-silent", action="store_true",
+                        help="Write every stem and always run drumsep, even when a stem is silent")
+    parser.add_argument("--checkpoint", action="store_true",
+                        help="Checkpoint each finished stage so an interrupted run resumes where it stopped")
+    parser.add_argument("--no-cache", action="store_true", help="Don't read or write the separation cache")
+    parser.add_argument("--refresh", action="store_true", help="Ignore cached results and overwrite them")
+    parser.add_argument("--profile", nargs="?", const="reports", metavar="DIR",
+                        help="Write per-stage timing/memory JSON reports to DIR (default: ./reports)")
+    parser.add_argument("--watch", metavar="DIR",
+                        help="Run as a daemon that splits every audio file dropped into DIR")
+    parser.add_argument("--serve", action="store_true",
+                        help="Run a local HTTP API that splits uploaded songs (see server in config.yaml)")
+    parser.add_argument("--port", type=int, help="Port for --serve (default: server.port)")
+    parser.add_argument("--preview", type=float, metavar="SECONDS",
+                        help="Quickly split just the liveliest SECONDS of each song into Previews/ in the output directory")
+    parser.add_argument("--full", action="store_true",
+                        help="With --preview, go on to split the whole song, reusing the preview's decode and analysis")
+    parser.add_argument("--index", action="store_true",
+                        help="Only analyze key/BPM of new or changed inputs into the library index (no splitting)")
+    parser.add_argument("--find", metavar="KEY",
+                        help="List indexed tracks that mix with KEY (Camelot code like 8A, or a key like Am)")
+    parser.add_argument("--bpm", type=float, help="With --find, only tracks near this tempo")
+    parser.add_argument("--bpm-range", type=float, help="With --find, allowed BPM difference (default: library.bpm_range)")
+    parser.add_argument("--dry-run", action="store_true",
+                        help="Check dependencies and print the stems and output paths without processing anything")
+    args = parser.parse_args()
+    if not args.inputs and not args.watch and not args.serve and not args.find and args.bpm is None:
+        parser.error("give at least one input, --watch DIR, --serve or --find")
+    missing_inputs = [item for item in args.inputs
+                      if not glob.has_magic(item) and not os.path.exists(os.path.expanduser(item))]
+    if missing_inputs:
+        parser.error(f"file not found: {', '.join(missing_inputs)}")
+    if args.preview is not None and args.preview <= 0:
+        parser.error("--preview needs a positive number of seconds")
+    if args.full and args.preview is None:
+        parser.error("--full only applies to --preview")
+    run_started = time.perf_counter()
+    run_profiler = RunProfiler("run", enabled=bool(args.profile))
+    
+    # Load configuration
+    with run_profiler.stage("config_load"):
+        config = load_config(args.config)
+    
+    # Override output directory if specified
+    if args.output:
+        config["paths"]["output_dir"] = os.path.abspath(args.output)
+        
+    # Override demucs model if specified
+    if args.model:
+        config["tools"]["demucs_model"] = args.model
+        print(f"Overriding demucs model to: {args.model}")
+    
+    # Override batch settings if specified
+    if args.jobs:
+        config["batch"]["workers"] = args.jobs
+    if args.threads:
+        config["batch"]["threads_per_worker"] = args.threads
+    
+    if args.analysis:
+        config["analysis"]["mode"] = args.analysis
+    
+    if args.performance:
+        if args.performance not in config["performance"]["profiles"]:
+            parser.error(f"unknown performance profile '{args.performance}', choose from "
+                         f"{', '.join(config['performance']['profiles'])}")
+        config["performance"]["profile"] = args.performance
+    if not config["batch"]["threads_per_worker"]:
+        # --threads and batch.threads_per_worker win over the profile
+        config["batch"]["threads_per_worker"] = performance_profile(config)["intra_op_threads"]
+    
+    if args.format:
+        config["output"]["format"] = args.format
+    if args.keep_intermediates:
+        config["output"]["keep_intermediates"] = True
+    if args.stream:
+        config["streaming"]["mode"] = "always"
+    if args.keep_silent:
+        config["silence"]["enabled"] = False
+    if args.checkpoint:
+        config["checkpoint"]["enabled"] = True
+    
+    # Override cache settings if specified
+    if args.no_cache:
+        config["cache"]["enabled"] = False
+    if args.refresh:
+        config["cache"]["refresh"] = True
+    if args.port:
+        config["server"]["port"] = args.port
+    
+    # Library lookups only read the index, so they skip the dependency check below
+    if args.find or (args.bpm is not None and not args.inputs):
+        try:
+            find_compatible(config, args.find, args.bpm, args.bpm_range)
+        except PipelineError as e:
+            print(f"⚠️ {e}")
+            sys.exit(1)
+        return
+    
+    if args.dry_run:
+        if args.serve:
+            print(f"Would serve on http://{config['server']['host']}:{config['server']['port']}")
+        if args.watch:
+            print(f"Would watch {os.path.abspath(args.watch)} (queue: {config['watch']['queue_db']})")
+        if not dry_run(collect_input_files(args.inputs), config):
+            sys.exit(1)
+        return
+    
+    missing = missing_modules()
+    if missing:
+        print(f"Error: {', '.join(missing)} not installed.")
+        print("Please install the dependencies using: pip install -r requirements.txt")
+        sys.exit(1)
+    
+    # Ensure directories exist
+    os.makedirs(config["paths"]["temp_dir"], exist_ok=True)
+    os.makedirs(config["paths"]["output_dir"], exist_ok=True)
+    
+    # Treat a polite kill like Ctrl+C, so daemons requeue their jobs and scratch
+    # folders are removed on the way out; anything harder is collected here next time.
+    # Signals that are already handled or ignored (e.g. SIGHUP under nohup) are left alone.
+    for name in ("SIGTERM", "SIGHUP"):
+        signum = getattr(signal, name, None)
+        if signum is not None and signal.getsignal(signum) == signal.SIG_DFL:
+            signal.signal(signum, signal.default_int_handler)
+    collect_scratch_orphans(config)
+    
+    if args.serve:
+        workers, threads = plan_workers(os.cpu_count() or 1, config["batch"]["workers"],
+                                        config["batch"]["threads_per_worker"])
+        serve(config, _serve_job, _init_server_worker, workers, threads)
+        return
+    
+    if args.watch:
+        try:
+            watch_folder(args.watch, config)
+        except PipelineError as e:
+            print(f"⚠️ {e}")
+            sys.exit(1)
+        return
+    
+    if args.index:
+        if not index_library(args.inputs, config):
+            sys.exit(1)
+        return
+    
+    input_files = collect_input_files(args.inputs)
+    if not input_files:
+        print("Error: No audio files found in the given inputs.")
+        sys.exit(1)
+    
+    if args.compare_analysis:
+        compare_analysis_modes(input_files)
+        return
+    
+    # Songs split in this process use the planned thread count too
+    configure_threads(config["batch"]["threads_per_worker"])
+    
+    if args.preview:
+        results = []
+        for input_file in input_files:
+            profiler = RunProfiler(get_song_name(input_file), enabled=bool(args.profile))
+            try:
+                output_dir = preview_song(input_file, config, args.preview, full=args.full,
+                                          open_result=len(input_files) == 1, profiler=profiler)
+                results.append((input_file, output_dir, None, profiler.report()))
+            except PipelineError as e:
+                print(f"⚠️ {e}")
+                results.append((input_file, None, str(e), profiler.report()))
+        if args.profile:
+            write_profile_reports(args.profile, results, run_profiler, time.perf_counter() - run_started)
+        if not print_batch_summary(results):
+            sys.exit(1)
+        return
+    
+    # A single file keeps the original behaviour: fail loudly and open the result
+    if len(input_files) == 1:
+        profiler = RunProfiler(get_song_name(input_files[0]), enabled=bool(args.profile))
+        try:
+            split_song(input_files[0], config, profiler=profiler)
+        except PipelineError as e:
+            print(f"⚠️ {e}")
+            print("Aborting.")
+            sys.exit(1)
+        finally:
+            if args.profile:
+                results = [(input_files[0], None, None, profiler.report())]
+                write_profile_reports(args.profile, results, run_profiler, time.perf_counter() - run_started)
+        return
+    
+    results = run_batch(input_files, config, profile=bool(args.profile))
+    if args.profile:
+        write_profile_reports(args.profile, results, run_profiler, time.perf_counter() - run_started)
+    if not print_batch_summary(results):
+        sys.exit(1)
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
@@ -5,12 +5,8 @@ import platform
 import importlib.util
 
 def check_module(name):
-    """Check if a module can be imported."""
-    try:
-        importlib.import_module(name)
-        return True
-    except ImportError:
-        return False
+    """Check if a module is installed, without importing it."""
+    return importlib.util.find_spec(name) is not None
 
 def check_file(path):
     """Check if a file exists."""
@@ -40,7 +36,7 @@ def main():
     )
     
     # Check critical dependencies
-    for module in ["librosa", "numpy", "yaml", "demucs"]:
+    for module in ["librosa", "numpy", "soundfile", "yaml", "torch", "demucs"]:
         all_good &= print_status(f"Module {module}", check_module(module))
     
     # Check directory structure
@@ -0,0 +1,149 @@
+#!/usr/bin/env python3
+"""Check the --serve HTTP API on localhost without the models.
+
+A stand-in job copies the upload to a fake stem, so this runs anywhere in a
+few seconds. It covers uploads, per-job output folders, Server-Sent Events,
+stem downloads, bad requests, the 503 on a full queue and forgetting old
+finished jobs.
+"""
+import http.client
+import json
+import os
+import shutil
+import sys
+import tempfile
+import threading
+import time
+from http.server import ThreadingHTTPServer
+
+from job_server import JobRequestHandler, JobServer
+
+JOB_SECONDS = 1.0
+
+_events = None
+
+
+def fake_init(threads, events, config):
+    global _events
+    _events = events
+
+
+def fake_job(job_id, input_file, config):
+    """Stand-in for _serve_job: 'separates' the upload into one stem that is a copy of it."""
+    _events.put({"event": "started", "job": job_id})
+    time.sleep(JOB_SECONDS)
+    song = os.path.splitext(os.path.basename(input_file))[0]
+    output_dir = os.path.join(config["paths"]["output_dir"], song)
+    stem = os.path.join(output_dir, "stems", f"{song}_vocals.wav")
+    os.makedirs(os.path.dirname(stem), exist_ok=True)
+    shutil.copyfile(input_file, stem)
+    return output_dir, None, {"info": {"output_files": [stem]}}
+
+
+def request(port, method, path, body=None):
+    conn = http.client.HTTPConnection("127.0.0.1", port, timeout=30)
+    conn.request(method, path, body=body)
+    response = conn.getresponse()
+    data = response.read()
+    conn.close()
+    return response.status, dict(response.getheaders()), data
+
+
+def upload(port, filename, body, priority=None):
+    path = f"/jobs?filename={filename}" + (f"&priority={priority}" if priority is not None else "")
+    status, headers, data = request(port, "POST", path, body)
+    return status, headers, json.loads(data)
+
+
+def read_events(port, job_id):
+    """Event names from the job's SSE stream, read until the server closes it."""
+    status, _, data = request(port, "GET", f"/jobs/{job_id}/events")
+    return status, [line[len("event: "):] for line in data.decode().splitlines() if line.startswith("event: ")]
+
+
+def print_status(message, success):
+    print(f"{'✅' if success else '❌'} {message}")
+    return success
+
+
+def main():
+    work_dir = tempfile.mkdtemp(prefix="stem_server_test_")
+    config = {
+        "paths": {"temp_dir": os.path.join(work_dir, "temp"), "output_dir": os.path.join(work_dir, "output")},
+        "server": {"host": "127.0.0.1", "port": 0, "queue_depth": 1, "max_upload_mb": 1,
+                   "keep_finished_jobs": 2},
+    }
+    jobs = JobServer(config, fake_job, fake_init, workers=1, threads=1)
+    httpd = ThreadingHTTPServer(("127.0.0.1", 0), JobRequestHandler)
+    httpd.daemon_threads = True
+    httpd.jobs = jobs
+    port = httpd.server_address[1]
+    jobs.start()
+    threading.Thread(target=httpd.serve_forever, daemon=True).start()
+    all_good = True
+    try:
+        status, _, _ = upload(port, "song.wav", b"x", priority="high")
+        all_good &= print_status(f"Non-integer priority is refused (HTTP {status})", status == 400)
+
+        # One worker and queue_depth 1: the first job runs, the second waits, the third is refused
+        first_status, headers, first = upload(port, "song.wav", b"first upload")
+        all_good &= print_status(f"Upload accepted (HTTP {first_status})",
+                                 first_status == 202 and headers.get("Location") == f"/jobs/{first['id']}")
+        second_status, _, second = upload(port, "song.wav", b"second upload")
+        all_good &= print_status(f"Second upload queued (HTTP {second_status})",
+                                 second_status == 202 and second["status"] == "queued")
+        status, headers, _ = upload(port, "other.wav", b"third upload")
+        all_good &= print_status(f"Full queue is refused (HTTP {status}, Retry-After {headers.get('Retry-After')})",
+                                 status == 503 and "Retry-After" in headers)
+
+        status, events = read_events(port, first["id"])
+        all_good &= print_status(f"Event stream: {' → '.join(events)}",
+                                 status == 200 and events[:2] == ["queued", "started"] and events[-1] == "done")
+        read_events(port, second["id"])
+
+        stems = {}
+        for job, body in ((first, b"first upload"), (second, b"second upload")):
+            _, _, data = request(port, "GET", f"/jobs/{job['id']}")
+            info = json.loads(data)
+            all_good &= print_status(f"Job {job['id']} is {info['status']} with stems {info['stems']}",
+                                     info["status"] == "done" and info["stems"] == ["song_vocals.wav"])
+            stems[job["id"]] = info["output_dir"]
+            status, headers, data = request(port, "GET", f"/jobs/{job['id']}/stems/song_vocals.wav")
+            all_good &= print_status(f"Stem download (HTTP {status}, {headers.get('Content-Type')})",
+                                     status == 200 and data == body)
+        all_good &= print_status("Uploads with the same name get separate output folders",
+                                 len(set(stems.values())) == 2)
+
+        status, _, _ = request(port, "GET", f"/jobs/{first['id']}/stems/missing.wav")
+        all_good &= print_status(f"Unknown stem (HTTP {status})", status == 404)
+        status, _, data = request(port, "GET", "/health")
+        all_good &= print_status(f"Health check (HTTP {status})", status == 200 and json.loads(data)["done"] == 2)
+
+        # keep_finished_jobs is 2, so a third finished job pushes out the first
+        _, _, third = upload(port, "third.wav", b"third upload")
+        read_events(port, third["id"])
+        status, _, _ = request(port, "GET", f"/jobs/{first['id']}")
+        # Its output folder is deleted just after the third job's "done" event
+        deadline = time.time() + 5
+        while os.path.exists(os.path.dirname(stems[first["id"]])) and time.time() < deadline:
+            time.sleep(0.05)
+        all_good &= print_status(f"Oldest finished job forgotten (HTTP {status})",
+                                 status == 404 and not os.path.exists(os.path.dirname(stems[first["id"]])))
+        status, _, _ = request(port, "GET", f"/jobs/{second['id']}")
+        all_good &= print_status(f"Newer finished job kept (HTTP {status})",
+                                 status == 200 and os.path.exists(stems[second["id"]]))
+    finally:
+        httpd.shutdown()
+        httpd.server_close()
+        jobs.stop()
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+    if all_good:
+        print("\n✅ All server checks passed!")
+        return 0
+    print("\n❌ Some server checks failed.")
+    return 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())